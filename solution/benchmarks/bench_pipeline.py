@@ -0,0 +1,159 @@
+"""Сквозной бенчмарк DDS -> CDM на синтетических заказах без брокера.
+
+Исходные сообщения генерируются OrderGenerator и читаются DdsMessageProcessor
+из топика в памяти; его выходные сообщения становятся входом CdmMessageProcessor.
+По умолчанию SQL не выполняется, а считается (CapturingPgConnect); с --pg-host
+запись идёт в локальный Postgres со схемами dds и cdm.
+
+Запуск: python benchmarks/bench_pipeline.py --orders 20000 --basket-size 5 --status-mix CLOSED=0.6,OPEN=0.4
+"""
+import argparse
+import json
+import logging
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+# Пакеты lib в обоих сервисах одинаковые, поэтому достаточно одного пути для lib
+sys.path[:0] = [str(ROOT / 'service_dds' / 'src'), str(ROOT / 'service_cdm' / 'src')]
+
+from lib.kafka_connect import get_serializer  # noqa: E402
+from lib.pg import PgConnect  # noqa: E402
+from dds_loader.dds_message_processor_job import DdsMessageProcessor  # noqa: E402
+from dds_loader.repository import KEY_GENERATOR, DdsKnownKeys, DdsRepository, DdsSatelliteCache  # noqa: E402
+from cdm_loader.cdm_message_processor_job import CdmMessageProcessor  # noqa: E402
+from cdm_loader.repository import CdmRepository  # noqa: E402
+
+from orders import OrderGenerator, parse_status_mix  # noqa: E402
+from standins import CapturingPgConnect, MemoryConsumer, MemoryProducer  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux - килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def drive(processor, consumer: MemoryConsumer) -> Dict[str, Any]:
+    """Прогоняет весь топик через processor.process_batch, как это делает StreamingLoop."""
+    latencies: List[float] = []
+    started = time.perf_counter()
+    while not consumer.exhausted:
+        messages = consumer.consume_batch(processor.batch_size)
+        batch_started = time.perf_counter()
+        processor.process_batch(messages)
+        # Каждое сообщение пачки готово только по завершении всей пачки
+        latencies.extend([time.perf_counter() - batch_started] * len(messages))
+    elapsed = time.perf_counter() - started
+    return {
+        'messages': len(consumer),
+        'seconds': round(elapsed, 3),
+        'msgs_per_s': round(len(consumer) / elapsed, 1) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def sql_report(db, orders: int) -> Dict[str, Any]:
+    if not isinstance(db, CapturingPgConnect) or not orders:
+        return {}
+    stats = db.stats
+    return {
+        'statements_per_order': round(stats.statements / orders, 2),
+        'calls_per_order': round(stats.calls / orders, 2),
+        'transactions': stats.transactions,
+        'statements_by_table': dict(stats.by_table.most_common()),
+    }
+
+
+def make_db(args: argparse.Namespace):
+    if not args.pg_host:
+        return CapturingPgConnect()
+    return PgConnect(args.pg_host, args.pg_port, args.pg_db, args.pg_user, args.pg_password,
+                     sslmode=args.pg_sslmode, pool_min_size=1, pool_max_size=1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=10_000)
+    parser.add_argument('--basket-size', type=int, default=5)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--products', type=int, default=2_000)
+    parser.add_argument('--restaurants', type=int, default=50)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--status-mix', default='CLOSED=1', help="например CLOSED=0.6,OPEN=0.3,CANCELLED=0.1")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--dds-batch-size', type=int, default=30)
+    parser.add_argument('--cdm-batch-size', type=int, default=100)
+    parser.add_argument('--serializer', default='auto')
+    parser.add_argument('--known-keys-size', type=int, default=0)
+    parser.add_argument('--satellite-cache-size', type=int, default=0)
+    parser.add_argument('--pg-host')
+    parser.add_argument('--pg-port', type=int, default=5432)
+    parser.add_argument('--pg-db', default='de')
+    parser.add_argument('--pg-user', default='postgres')
+    parser.add_argument('--pg-password', default='')
+    parser.add_argument('--pg-sslmode', default='disable')
+    parser.add_argument('--json', action='store_true', help="вывести результат одной строкой JSON")
+    args = parser.parse_args()
+
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.WARNING)
+    serializer = get_serializer(args.serializer)
+
+    generator = OrderGenerator(args.basket_size, args.users, args.products, args.restaurants, args.categories,
+                               parse_status_mix(args.status_mix), args.seed)
+    source = MemoryConsumer((value for value, _ in generator.messages(args.orders)), serializer=serializer)
+    rss_before = peak_rss_mb()
+
+    dds_db = make_db(args)
+    known_keys = DdsKnownKeys(args.known_keys_size) if args.known_keys_size else None
+    satellites = DdsSatelliteCache(args.satellite_cache_size) if args.satellite_cache_size else None
+    producer = MemoryProducer(serializer)
+    dds = DdsMessageProcessor(source, producer, DdsRepository(dds_db, known_keys, satellites), logger,
+                              batch_size=args.dds_batch_size)
+    dds_result = drive(dds, source)
+    dds_result['orders_written'] = len(producer.values)
+    dds_result.update(sql_report(dds_db, len(producer.values)))
+    dds_result['key_cache'] = KEY_GENERATOR.stats()
+    dds_result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+    cdm_db = make_db(args)
+    if args.pg_host:
+        CdmRepository.create_tables(cdm_db)
+    cdm_source = MemoryConsumer(producer.values, serializer=serializer)
+    cdm = CdmMessageProcessor(cdm_source, CdmRepository(cdm_db), logger, batch_size=args.cdm_batch_size)
+    cdm_result = drive(cdm, cdm_source)
+    cdm_result.update(sql_report(cdm_db, len(cdm_source)))
+    cdm_result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+    result = {
+        'params': vars(args),
+        'source_peak_rss_mb': round(rss_before, 1),
+        'dds': dds_result,
+        'cdm': cdm_result,
+    }
+    if args.json:
+        print(json.dumps(result, default=str))
+        return
+
+    print(f"orders: {args.orders}, basket: {args.basket_size}, status mix: {args.status_mix}, "
+          f"serializer: {serializer.name}, db: {'postgres' if args.pg_host else 'capturing fake'}")
+    print(f"peak RSS after generating source: {result['source_peak_rss_mb']} MB")
+    for name in ('dds', 'cdm'):
+        print(f"\n[{name}]")
+        for key, value in result[name].items():
+            print(f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Микробенчмарк сериализаторов lib/kafka_connect на сообщениях DDS/CDM.
+
+Запуск: python benchmarks/bench_serialization.py --products 200 --number 2000
+"""
+import argparse
+import importlib.util
+import json
+import timeit
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+SERIALIZERS_PATH = Path(__file__).resolve().parents[1] / 'service_dds' / 'src' / 'lib' / 'kafka_connect' / 'serializers.py'
+
+
+def load_serializers():
+    # Модуль грузится по пути, чтобы бенчмарку не нужен был confluent_kafka из lib/kafka_connect
+    spec = importlib.util.spec_from_file_location('serializers', SERIALIZERS_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def source_message(products: int) -> bytes:
+    payload = {
+        'object_id': 322519,
+        'object_type': 'order',
+        'payload': {
+            'user': {'id': '626a81ce9a8cd1920641e296', 'name': 'Иван Иванов', 'login': 'ivanov'},
+            'restaurant': {'id': 'a51e4e31ae4602047ec52534', 'name': 'Кафе'},
+            'order': {'id': 322519, 'date': '2022-11-05 20:49:02', 'cost': 2460.0, 'payment': 2460.0},
+            'products': [
+                {'id': f'{i:024x}', 'name': f'Блюдо {i}', 'price': 180, 'quantity': i % 5 + 1}
+                for i in range(products)
+            ],
+            'categories': [{'name': f'Категория {i}'} for i in range(max(1, products // 10))],
+            'status': 'CLOSED',
+        },
+    }
+    return json.dumps(payload).encode()
+
+
+def destination_message(products: int) -> dict:
+    return {
+        'user_id': uuid.uuid4(),
+        'product_id': [uuid.uuid4() for _ in range(products)],
+        'product_name': [f'Блюдо {i}' for i in range(products)],
+        'category_id': [uuid.uuid4() for _ in range(max(1, products // 10))],
+        'category_name': [f'Категория {i}' for i in range(max(1, products // 10))],
+        'order_cnt': [i % 5 + 1 for i in range(products)],
+        'load_dt': datetime.utcnow(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    serializers = load_serializers()
+    raw = source_message(args.products)
+    dst = destination_message(args.products)
+
+    # Базовая линия - прежний путь: decode() + json.loads и json.dumps без поддержки UUID
+    baseline_loads = timeit.timeit(lambda: json.loads(raw.decode()), number=args.number)
+    print(f"{'stdlib (decode+loads)':<24} loads {baseline_loads / args.number * 1e6:9.1f} us/msg")
+
+    for name in ('json', 'orjson', 'msgspec'):
+        try:
+            serializer = serializers.get_serializer(name)
+        except ValueError as e:
+            print(f"{name:<24} {e}")
+            continue
+        loads = timeit.timeit(lambda: serializer.loads(raw), number=args.number)
+        dumps = timeit.timeit(lambda: serializer.dumps(dst), number=args.number)
+        print(f"{name:<24} loads {loads / args.number * 1e6:9.1f} us/msg, "
+              f"dumps {dumps / args.number * 1e6:9.1f} us/msg, "
+              f"loads speedup x{baseline_loads / loads:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Генератор синтетических заказов в формате, который ожидает OrderDdsBuilder."""
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Tuple
+
+STATUSES = ('CLOSED', 'OPEN', 'CANCELLED')
+
+
+def parse_status_mix(value: str) -> Dict[str, float]:
+    """'CLOSED=0.7,OPEN=0.2,CANCELLED=0.1' -> {'CLOSED': 0.7, ...}"""
+    mix = {}
+    for part in value.split(','):
+        status, _, weight = part.partition('=')
+        mix[status.strip().upper()] = float(weight or 1)
+    return mix
+
+
+class OrderGenerator:
+    def __init__(self,
+                 basket_size: int = 5,
+                 users: int = 10_000,
+                 products: int = 2_000,
+                 restaurants: int = 50,
+                 categories: int = 20,
+                 status_mix: Dict[str, float] = None,
+                 seed: int = 42) -> None:
+        self._basket_size = basket_size
+        self._users = users
+        self._products = products
+        self._restaurants = restaurants
+        self._categories = categories
+        self._status_mix = status_mix or {'CLOSED': 1.0}
+        self._random = random.Random(seed)
+        self._start = datetime(2022, 11, 1)
+
+    def _basket(self) -> int:
+        # Размер корзины колеблется вокруг basket_size, но не меньше одного товара
+        return max(1, int(self._random.gauss(self._basket_size, self._basket_size / 3)))
+
+    def payload(self, order_id: int) -> Dict:
+        user = self._random.randrange(self._users)
+        restaurant = self._random.randrange(self._restaurants)
+        products = self._random.sample(range(self._products), min(self._basket(), self._products))
+        categories = sorted({product % self._categories for product in products})
+        cost = 0.0
+        items = []
+        for product in products:
+            price = 100 + product % 900
+            quantity = self._random.randint(1, 5)
+            cost += price * quantity
+            items.append({'id': f'{product:024x}', 'name': f'Блюдо {product}', 'price': price, 'quantity': quantity})
+
+        status = self._random.choices(list(self._status_mix), weights=list(self._status_mix.values()))[0]
+        return {
+            'user': {'id': f'{user:024x}', 'name': f'Пользователь {user}', 'login': f'user{user}'},
+            'restaurant': {'id': f'{restaurant:024x}', 'name': f'Ресторан {restaurant}'},
+            'order': {
+                'id': order_id,
+                'date': (self._start + timedelta(seconds=order_id)).strftime('%Y-%m-%d %H:%M:%S'),
+                'cost': cost,
+                'payment': cost,
+            },
+            'products': items,
+            'categories': [{'name': f'Категория {category}'} for category in categories],
+            'status': status,
+        }
+
+    def messages(self, count: int) -> Iterator[Tuple[bytes, str]]:
+        """Сообщения исходного топика: (value, status)."""
+        for order_id in range(count):
+            payload = self.payload(order_id)
+            value = {'object_id': order_id, 'object_type': 'order', 'payload': payload}
+            yield json.dumps(value, ensure_ascii=False).encode(), payload['status']
+
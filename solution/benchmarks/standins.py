@@ -0,0 +1,160 @@
+"""Локальные замены Kafka и Postgres для бенчмарков: без брокера и без БД."""
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from lib.kafka_connect import DEFAULT_SERIALIZER, KafkaMessage
+
+
+class MemoryConsumer:
+    """Топик в памяти с интерфейсом KafkaConsumer: одна партиция, оффсет - индекс сообщения."""
+
+    def __init__(self, values: Iterable[bytes], topic: str = 'bench', serializer=DEFAULT_SERIALIZER) -> None:
+        self.topic = topic
+        self.serializer = serializer
+        self._values = list(values)
+        self._position = 0
+        self._committed = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @property
+    def exhausted(self) -> bool:
+        return self._position >= len(self._values)
+
+    def consume_batch(self, num_messages: int, timeout: float = 1.0) -> List[KafkaMessage]:
+        start = self._position
+        self._position = min(len(self._values), start + num_messages)
+        return [
+            KafkaMessage(self.topic, 0, offset, None, None, self._values[offset], self.serializer)
+            for offset in range(start, self._position)
+        ]
+
+    def commit(self) -> None:
+        self._committed = self._position
+
+    def commit_offsets(self, offsets: Dict[Tuple[str, int], int]) -> None:
+        for offset in offsets.values():
+            self._committed = max(self._committed, offset)
+
+    def rewind(self) -> None:
+        self._position = self._committed
+
+    def lag(self) -> Dict[Tuple[str, int], int]:
+        return {(self.topic, 0): len(self._values) - self._position}
+
+    def set_rebalance_callbacks(self, on_assign=None, on_revoke=None) -> None:
+        pass
+
+    def pause(self) -> None:
+        pass
+
+    def resume(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryProducer:
+    """Собирает отправленные сообщения; их можно передать в MemoryConsumer следующего сервиса."""
+
+    def __init__(self, serializer=DEFAULT_SERIALIZER) -> None:
+        self.serializer = serializer
+        self.values: List[bytes] = []
+
+    def produce(self, payload: Any) -> None:
+        self.values.append(self.serializer.dumps(payload))
+
+    def flush(self, timeout: float = 30.0) -> None:
+        pass
+
+
+class SqlStats:
+    def __init__(self) -> None:
+        # statements - число выполненных операторов (строк executemany),
+        # calls - число вызовов execute/executemany, т.е. обращений к драйверу
+        self.statements = 0
+        self.calls = 0
+        self.transactions = 0
+        self.by_table: Counter = Counter()
+
+    def record(self, query: Any, statements: int) -> None:
+        self.calls += 1
+        self.statements += statements
+        self.by_table[_table_name(query)] += statements
+
+
+def _table_name(query: Any) -> str:
+    text = query if isinstance(query, str) else repr(query)
+    for word in text.replace('(', ' ').split():
+        if word.startswith(('dds.', 'cdm.')):
+            return word.rstrip(';,')
+    return text.split()[0].lower() if text.split() else '?'
+
+
+class CapturingCursor:
+    def __init__(self, stats: SqlStats) -> None:
+        self._stats = stats
+        self._returning: List[Tuple[Any, ...]] = []
+
+    def __enter__(self) -> 'CapturingCursor':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def __iter__(self):
+        return iter(())
+
+    def execute(self, query: Any, params: Optional[Any] = None) -> 'CapturingCursor':
+        self._stats.record(query, 1)
+        # insert ... select unnest(%s) ... returning в пустой БД возвращает все вставленные значения
+        self._returning = []
+        if isinstance(query, str) and 'returning' in query.lower() and params:
+            self._returning = [(value,) for value in params[0]]
+        return self
+
+    def executemany(self, query: Any, params_seq: Iterable[Any]) -> None:
+        self._stats.record(query, sum(1 for _ in params_seq))
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        # Пустая БД: ни одной существующей строки
+        return self._returning
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        return None
+
+
+class CapturingConnection:
+    def __init__(self, stats: SqlStats) -> None:
+        self._stats = stats
+
+    def cursor(self) -> CapturingCursor:
+        return CapturingCursor(self._stats)
+
+    def execute(self, query: Any, params: Optional[Any] = None) -> CapturingCursor:
+        return self.cursor().execute(query, params)
+
+
+class CapturingPgConnect:
+    """Подмена PgConnect: запросы не выполняются, а только считаются."""
+
+    def __init__(self) -> None:
+        self.stats = SqlStats()
+
+    @property
+    def pooled(self) -> bool:
+        return False
+
+    @contextmanager
+    def connection(self):
+        yield CapturingConnection(self.stats)
+        self.stats.transactions += 1
+
+    def pool_stats(self) -> Dict[str, int]:
+        return {}
+
+    def close(self) -> None:
+        pass
@@ -1,11 +1,16 @@
 import logging
+import signal
+import sys
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask
 
 from app_config import AppConfig
+from lib.kafka_connect import AsyncPipeline, StreamingLoop
+from lib.metrics import ReadinessProbe, metrics_response, register_consumer, register_pg_pool
+from cdm_loader.cdm_async_processor import AsyncCdmMessageProcessor
 from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
-from cdm_loader.repository import CdmRepository
+from cdm_loader.repository import AsyncCdmRepository, CdmRepository
 
 
 app = Flask(__name__)
@@ -18,19 +23,101 @@ def hello_world():
     return 'healthy'
 
 
+@app.get('/metrics')
+def metrics():
+    return metrics_response()
+
+
+readiness = None
+
+
+@app.get('/ready')
+def ready():
+    # Пока потребитель не создан, под не готов
+    if readiness is None:
+        return {'ready': False}, 503
+    is_ready, state = readiness.check()
+    return state, 200 if is_ready else 503
+
+
 if __name__ == '__main__':
     app.logger.setLevel(logging.DEBUG)
 
     config = AppConfig()
 
+    consumer = config.message_source()
+    db = config.pg_warehouse_db()
+    register_consumer(consumer)
+    register_pg_pool(db)
+    readiness = ReadinessProbe(consumer, db, config.ready_max_batch_age_s)
+
+    dead_letters = config.dead_letter_sink()
+    cdm_repository = CdmRepository(db, config.cdm_dedup_orders)
+    if config.cdm_dedup_orders:
+        CdmRepository.create_tables(db)
+
+        if config.cdm_dedup_retention_hours > 0:
+            def purge_processed_orders():
+                purged = cdm_repository.purge_processed_orders(config.cdm_dedup_retention_hours)
+                app.logger.info(f"Purged {purged} processed orders older than {config.cdm_dedup_retention_hours}h")
+
+            purger = BackgroundScheduler()
+            purger.add_job(func=purge_processed_orders, trigger="interval", seconds=config.cdm_dedup_purge_interval_s)
+            purger.start()
+
     proc = CdmMessageProcessor(
-        consumer=config.kafka_consumer(),
-        cdm_repository=CdmRepository(config.pg_warehouse_db()),
-        logger=app.logger
+        consumer=consumer,
+        cdm_repository=cdm_repository,
+        logger=app.logger,
+        batch_size=config.batch_size,
+        commit_every=config.kafka_commit_every,
+        dead_letters=dead_letters,
+        retry_policy=config.retry_policy()
     )
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=proc.run, trigger="interval", seconds=25)
-    scheduler.start()
+    if config.processing_mode == 'scheduler':
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(func=proc.run, trigger="interval", seconds=25)
+        scheduler.start()
+    else:
+        if config.processing_mode == 'async':
+            async_db = config.async_pg_warehouse_db()
+
+            def create_stages():
+                return AsyncCdmMessageProcessor(
+                    cdm_repository=AsyncCdmRepository(async_db, config.cdm_dedup_orders),
+                    logger=app.logger,
+                    dead_letters=dead_letters,
+                    retry_policy=config.retry_policy()
+                ).stages()
+
+            loop = AsyncPipeline(
+                source=consumer,
+                stages_factory=create_stages,
+                logger=app.logger,
+                lanes=config.async_lanes,
+                batch_size=config.batch_size,
+                queue_size=config.async_queue_size,
+                max_retries=config.async_retries,
+                on_close=async_db.close
+            )
+        else:
+            loop = StreamingLoop(
+                consumer=consumer,
+                handler=proc.process_batch,
+                logger=app.logger,
+                batch_size=config.batch_size,
+                linger_ms=config.stream_linger_ms,
+                sizer=config.batch_sizer()
+            )
+        loop.start()
+
+        def shutdown(signum, frame):
+            # Дожидаемся текущей пачки и commit оффсетов, затем выходим
+            app.logger.info("SIGTERM received, stopping consumer")
+            loop.stop()
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, shutdown)
 
     app.run(debug=True, host='0.0.0.0', use_reloader=False)
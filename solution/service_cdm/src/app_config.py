@@ -1,7 +1,9 @@
 import os
+from typing import Optional
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
-from lib.pg import PgConnect
+from lib.kafka_connect import (AdaptiveBatchSizer, DeadLetterSink, FileDeadLetterSink, FileSource, KafkaConsumer,
+                               KafkaDeadLetterSink, KafkaProducer, MessageSource, RetryPolicy, get_serializer)
+from lib.pg import AsyncPgConnect, PgConnect
 
 
 class AppConfig:
@@ -15,12 +17,53 @@ class AppConfig:
         self.kafka_consumer_password = str(os.getenv('KAFKA_CONSUMER_PASSWORD'))
         self.kafka_consumer_group = str(os.getenv('KAFKA_CONSUMER_GROUP'))
         self.kafka_consumer_topic = str(os.getenv('KAFKA_SOURCE_TOPIC'))
+        self.kafka_commit_every = int(os.getenv('KAFKA_COMMIT_EVERY', '1'))
+        # auto - orjson/msgspec, если установлены, иначе стандартный json
+        self.kafka_serializer = os.getenv('KAFKA_SERIALIZER', 'auto')
+        # file - реплей дампа топика (JSONL/.gz по маске SOURCE_PATH) вместо чтения из Kafka
+        self.source_type = os.getenv('SOURCE_TYPE', 'kafka')
+        self.source_path = os.getenv('SOURCE_PATH', '')
+        self.source_checkpoint = os.getenv('SOURCE_CHECKPOINT', '')
+        # Сообщения, не прошедшие после повторов, уходят в DLQ_TOPIC, а без него - в файл DLQ_PATH, если он задан.
+        # Пустые оба - ошибка одного сообщения откатывает всю пачку.
+        self.dlq_topic = os.getenv('DLQ_TOPIC', '')
+        self.dlq_path = os.getenv('DLQ_PATH', '')
+        self.dlq_retries = int(os.getenv('DLQ_RETRIES', '2'))
+        self.dlq_retry_backoff_ms = int(os.getenv('DLQ_RETRY_BACKOFF_MS', '500'))
+
+        # stream - непрерывный цикл чтения, scheduler - запуск пачки раз в 25 секунд
+        self.processing_mode = os.getenv('PROCESSING_MODE', 'stream')
+        # async - конвейер на asyncio: полосы по партициям, очереди ASYNC_QUEUE_SIZE пачек между стадиями
+        self.async_lanes = int(os.getenv('ASYNC_LANES', '1'))
+        self.async_queue_size = int(os.getenv('ASYNC_QUEUE_SIZE', '4'))
+        # Столько попыток у пачки на стадии, затем она бросается и её партиции перечитываются
+        self.async_retries = int(os.getenv('ASYNC_RETRIES', '3'))
+        self.batch_size = int(os.getenv('BATCH_SIZE', '100'))
+        self.stream_linger_ms = int(os.getenv('STREAM_LINGER_MS', '500'))
+        # Адаптивный размер пачки: растёт, пока запись укладывается в BATCH_TARGET_LATENCY_MS
+        self.batch_adaptive = os.getenv('BATCH_ADAPTIVE', 'False').lower() == 'true'
+        self.batch_min_size = int(os.getenv('BATCH_MIN_SIZE', '10'))
+        self.batch_max_size = int(os.getenv('BATCH_MAX_SIZE', '1000'))
+        self.batch_target_latency_ms = int(os.getenv('BATCH_TARGET_LATENCY_MS', '1000'))
+        # Ограничение предвыборки librdkafka, чтобы память пода не росла при отставании записи
+        self.kafka_max_prefetch_kbytes = int(os.getenv('KAFKA_MAX_PREFETCH_KBYTES', '16384'))
+        # /ready: допустимое время без успешной пачки при наличии отставания
+        self.ready_max_batch_age_s = float(os.getenv('READY_MAX_BATCH_AGE_S', '300'))
+        # Учёт применённых заказов в cdm.processed_orders: повторы не увеличивают счётчики
+        self.cdm_dedup_orders = os.getenv('CDM_DEDUP_ORDERS', 'True').lower() == 'true'
+        # Записи старше CDM_DEDUP_RETENTION_HOURS удаляются раз в CDM_DEDUP_PURGE_INTERVAL_S секунд:
+        # повтор защищён только в этом окне, оно должно быть не меньше retention входного топика.
+        # 0 - записи не удаляются
+        self.cdm_dedup_retention_hours = int(os.getenv('CDM_DEDUP_RETENTION_HOURS', '168'))
+        self.cdm_dedup_purge_interval_s = int(os.getenv('CDM_DEDUP_PURGE_INTERVAL_S', '3600'))
 
         self.pg_warehouse_host = str(os.getenv('PG_WAREHOUSE_HOST'))
         self.pg_warehouse_port = int(str(os.getenv('PG_WAREHOUSE_PORT')))
         self.pg_warehouse_dbname = str(os.getenv('PG_WAREHOUSE_DBNAME'))
         self.pg_warehouse_user = str(os.getenv('PG_WAREHOUSE_USER'))
         self.pg_warehouse_password = str(os.getenv('PG_WAREHOUSE_PASSWORD'))
+        self.pg_pool_min_size = int(os.getenv('PG_POOL_MIN_SIZE', '1'))
+        self.pg_pool_max_size = int(os.getenv('PG_POOL_MAX_SIZE', '4'))
 
     def kafka_producer(self):
         return KafkaProducer(
@@ -40,7 +83,46 @@ class AppConfig:
             self.kafka_consumer_password,
             self.kafka_consumer_topic,
             self.kafka_consumer_group,
-            self.CERTIFICATE_PATH
+            self.CERTIFICATE_PATH,
+            serializer=get_serializer(self.kafka_serializer),
+            max_prefetch_kbytes=self.kafka_max_prefetch_kbytes
+        )
+
+    def message_source(self) -> MessageSource:
+        if self.source_type == 'file':
+            return FileSource(
+                self.source_path,
+                topic=self.kafka_consumer_topic,
+                checkpoint_path=self.source_checkpoint or None,
+                serializer=get_serializer(self.kafka_serializer)
+            )
+        return self.kafka_consumer()
+
+    def dead_letter_sink(self) -> Optional[DeadLetterSink]:
+        if self.dlq_topic:
+            return KafkaDeadLetterSink(KafkaProducer(
+                self.kafka_host,
+                self.kafka_port,
+                self.kafka_consumer_username,
+                self.kafka_consumer_password,
+                self.dlq_topic,
+                self.CERTIFICATE_PATH
+            ))
+        if self.dlq_path:
+            return FileDeadLetterSink(self.dlq_path)
+        return None
+
+    def retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(retries=self.dlq_retries, backoff=self.dlq_retry_backoff_ms / 1000)
+
+    def batch_sizer(self) -> Optional[AdaptiveBatchSizer]:
+        if not self.batch_adaptive:
+            return None
+        return AdaptiveBatchSizer(
+            self.batch_size,
+            min_size=self.batch_min_size,
+            max_size=self.batch_max_size,
+            target_latency_ms=self.batch_target_latency_ms
         )
 
     def pg_warehouse_db(self):
@@ -49,5 +131,18 @@ class AppConfig:
             self.pg_warehouse_port,
             self.pg_warehouse_dbname,
             self.pg_warehouse_user,
-            self.pg_warehouse_password
+            self.pg_warehouse_password,
+            pool_min_size=self.pg_pool_min_size,
+            pool_max_size=self.pg_pool_max_size
+        )
+
+    def async_pg_warehouse_db(self):
+        return AsyncPgConnect(
+            self.pg_warehouse_host,
+            self.pg_warehouse_port,
+            self.pg_warehouse_dbname,
+            self.pg_warehouse_user,
+            self.pg_warehouse_password,
+            pool_min_size=self.pg_pool_min_size,
+            pool_max_size=self.pg_pool_max_size
         )
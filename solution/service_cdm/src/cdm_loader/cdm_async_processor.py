@@ -0,0 +1,78 @@
+import asyncio
+from logging import Logger
+from typing import Any, List, Optional, Sequence
+
+from psycopg import OperationalError
+
+from lib.kafka_connect import DeadLetterSink, KafkaMessage, RetryPolicy
+from lib.kafka_connect.async_pipeline import Stage
+from lib.metrics import BATCH_SIZE, MESSAGES_PROCESSED, mark_batch, timed
+from cdm_loader.cdm_message_processor_job import Applied, CdmMessageProcessor, Order
+from cdm_loader.repository import AsyncCdmRepository
+
+
+class AsyncCdmMessageProcessor(CdmMessageProcessor):
+    """Стадии AsyncPipeline для CDM: разбор заказов пачки и применение их приращений в Postgres.
+
+    Разбор и свёртка те же, что в CdmMessageProcessor. Приращения считаются в стадии
+    записи внутри транзакции, уже по заказам, которые ещё не применялись.
+    """
+
+    def __init__(self,
+                 cdm_repository: AsyncCdmRepository,
+                 logger: Logger,
+                 dead_letters: Optional[DeadLetterSink] = None,
+                 retry_policy: Optional[RetryPolicy] = None) -> None:
+        super().__init__(
+            consumer=None,
+            cdm_repository=cdm_repository,
+            logger=logger,
+            dead_letters=dead_letters,
+            retry_policy=retry_policy
+        )
+
+    def stages(self) -> List[Stage]:
+        return [self.build_stage, self.write_stage]
+
+    async def build_stage(self, messages: List[KafkaMessage], _: Any) -> Applied:
+        self.last_batch_skipped = 0
+        with timed('deserialize'):
+            parsed = self._parse(messages)
+        with timed('build'):
+            applied = self._aggregate(parsed)
+        BATCH_SIZE.observe(len(messages))
+        return applied
+
+    async def _apply_async(self, orders: Sequence[Order]) -> int:
+        order_ids = [order_id for order_id, _, _ in orders if order_id is not None]
+        return await self._cdm_repository.counters_apply_orders(order_ids, lambda new: self._delta_rows(orders, new))
+
+    async def write_stage(self, messages: List[KafkaMessage], applied: Applied) -> None:
+        rejected = 0
+        skipped = 0
+        try:
+            if applied:
+                with timed('db_batch'):
+                    skipped = await self._apply_async([order for _, order in applied])
+        except OperationalError:
+            raise
+        except Exception:
+            if self._dead_letters is None:
+                raise
+            self._logger.exception("Batch write failed, applying messages one by one")
+
+            for msg, order in applied:
+                try:
+                    skipped += await self._retry.call_async(lambda: self._apply_async([order]),
+                                                            fatal=(OperationalError,))
+                except OperationalError:
+                    raise
+                except Exception as e:
+                    self._reject(msg, e, 'db')
+                    rejected += 1
+
+        if self.last_batch_rejected:
+            self.last_batch_rejected = 0
+            await asyncio.to_thread(self._dead_letters.flush)
+        MESSAGES_PROCESSED.inc(len(applied) - rejected - skipped)
+        mark_batch()
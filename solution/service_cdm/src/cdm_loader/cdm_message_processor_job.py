@@ -1,46 +1,183 @@
 from datetime import datetime
 from logging import Logger
-from typing import Any, Dict, List, Tuple
+from typing import Any, Collection, Dict, List, Optional, Sequence, Tuple
 
-from lib.kafka_connect import KafkaConsumer
-from cdm_loader.repository import CdmRepository
+from psycopg import OperationalError
+
+from lib.kafka_connect import DeadLetterSink, KafkaMessage, MessageSource, RetryPolicy
+from lib.metrics import BATCH_SIZE, MESSAGES_PROCESSED, mark_batch, timed
+from cdm_loader.repository import CdmRepository, DeltaRows
+
+
+# Заказ из сообщения DDS: ключ заказа (None у сообщений без order_id), user_id
+# и товары (product_id, product_name, category_id, category_name, order_cnt)
+Order = Tuple[Optional[str], str, List[Tuple[str, str, str, str, int]]]
+Applied = List[Tuple[KafkaMessage, Order]]
 
 
 class CdmMessageProcessor:
     def __init__(self,
-                 consumer: KafkaConsumer,
+                 consumer: MessageSource,
                  cdm_repository: CdmRepository,
                  logger: Logger,
-                 batch_size: int = 100) -> None:
+                 batch_size: int = 100,
+                 commit_every: int = 1,
+                 dead_letters: Optional[DeadLetterSink] = None,
+                 retry_policy: Optional[RetryPolicy] = None) -> None:
         self._consumer = consumer
         self._cdm_repository = cdm_repository
         self._logger = logger
         self._batch_size = batch_size
+        self._commit_every = commit_every
+        self._uncommitted_batches = 0
+        # Без dead_letters ошибка любого сообщения, как и раньше, откатывает всю пачку.
+        # Sink общий для воркеров, но доставку своих сообщений процессор проверяет сам.
+        self._dead_letters = dead_letters.scoped() if dead_letters is not None else None
+        self._retry = retry_policy or RetryPolicy()
+        self.last_batch_rejected = 0
+        # Заказы, уже применённые раньше или повторённые в той же пачке
+        self.last_batch_skipped = 0
+
+    @staticmethod
+    def _parse_order(msg: Dict[str, Any]) -> Order:
+        # Сообщение разбирается целиком до применения, чтобы битое не оставило частичных приращений
+        products_info = [
+            (product_id, product_name, category_id, category_name, int(order_cnt))
+            for product_id, product_name, category_id, category_name, order_cnt in zip(
+                msg['product_id'],
+                msg['product_name'],
+                msg['category_id'],
+                msg['category_name'],
+                msg['order_cnt']
+            )
+        ]
+        return msg.get('order_id'), msg['user_id'], products_info
+
+    @staticmethod
+    def _delta_rows(orders: Sequence[Order], new_orders: Optional[Collection[str]] = None) -> DeltaRows:
+        """Приращения счётчиков, свёрнутые по ключам; с new_orders - только по новым заказам."""
+        # ключ -> [name, order_cnt]
+        product_deltas: Dict[Tuple[str, str], List[Any]] = {}
+        category_deltas: Dict[Tuple[str, str], List[Any]] = {}
+
+        for order_id, user_id, products in orders:
+            if new_orders is not None and order_id is not None and order_id not in new_orders:
+                continue
+            for product_id, product_name, category_id, category_name, order_cnt in products:
+                product_delta = product_deltas.setdefault((user_id, product_id), [product_name, 0])
+                product_delta[1] += order_cnt
+
+                category_delta = category_deltas.setdefault((user_id, category_id), [category_name, 0])
+                category_delta[1] += 1
+
+        # Сортировка по ключу даёт одинаковый порядок блокировок у параллельных транзакций
+        return (
+            [(user_id, key_id, name, cnt) for (user_id, key_id), (name, cnt) in sorted(product_deltas.items())],
+            [(user_id, key_id, name, cnt) for (user_id, key_id), (name, cnt) in sorted(category_deltas.items())]
+        )
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    def _reject(self, msg: KafkaMessage, error: Exception, stage: str) -> None:
+        if self._dead_letters is None:
+            raise error
+        self._logger.error(f"{msg.topic}[{msg.partition}]@{msg.offset} sent to dead letters at {stage}: {error!r}")
+        self._dead_letters.send(msg, error, stage)
+        self.last_batch_rejected += 1
+
+    def _parse(self, messages: List[KafkaMessage]) -> List[Tuple[KafkaMessage, Dict[str, Any]]]:
+        parsed = []
+        for msg in messages:
+            try:
+                parsed.append((msg, msg.payload()))
+            except Exception as e:
+                self._reject(msg, e, 'deserialize')
+        return parsed
+
+    def _aggregate(self, parsed: List[Tuple[KafkaMessage, Dict[str, Any]]]) -> Applied:
+        applied = []
+        seen = set()
+        for msg, payload in parsed:
+            try:
+                order = self._parse_order(payload)
+            except Exception as e:
+                self._reject(msg, e, 'build')
+                continue
+            # Повтор заказа внутри пачки применять не нужно
+            if order[0] is not None:
+                if order[0] in seen:
+                    self.last_batch_skipped += 1
+                    continue
+                seen.add(order[0])
+            applied.append((msg, order))
+        return applied
+
+    def _apply(self, orders: Sequence[Order]) -> int:
+        # Отметка заказов и upsert счётчиков - одна транзакция, приращения считаются только по новым заказам
+        order_ids = [order_id for order_id, _, _ in orders if order_id is not None]
+        return self._cdm_repository.counters_apply_orders(order_ids, lambda new: self._delta_rows(orders, new))
+
+    def _write(self, applied: Applied) -> None:
+        try:
+            with timed('db_batch'):
+                self.last_batch_skipped += self._apply([order for _, order in applied])
+            return
+        except OperationalError:
+            # Нет соединения с БД: пачка повторяется целиком
+            raise
+        except Exception:
+            if self._dead_letters is None:
+                raise
+            self._logger.exception("Batch write failed, applying messages one by one")
+
+        # Транзакция пачки откатилась вместе с отметками заказов, поэтому каждое сообщение
+        # применяется отдельно. Повтор пачки после сбоя не применит их второй раз.
+        for msg, order in applied:
+            try:
+                self.last_batch_skipped += self._retry.call(lambda: self._apply([order]), fatal=(OperationalError,))
+            except OperationalError:
+                raise
+            except Exception as e:
+                self._reject(msg, e, 'db')
+
+    def process_batch(self, messages: List[KafkaMessage]) -> None:
+        self.last_batch_rejected = 0
+        self.last_batch_skipped = 0
+
+        try:
+            with timed('deserialize'):
+                parsed = self._parse(messages)
+            with timed('build'):
+                applied = self._aggregate(parsed)
 
-    def _process_message(self, msg: Dict[str, Any]) -> None:
-        user_id = msg['user_id']
-        products_info = list(zip(
-            msg['product_id'], 
-            msg['product_name'], 
-            msg['category_id'], 
-            msg['category_name'], 
-            msg['order_cnt']
-        ))
+            self._write(applied)
+            # Отклонённые сообщения сохраняются до фиксации их оффсетов
+            if self.last_batch_rejected:
+                self._dead_letters.flush()
+            BATCH_SIZE.observe(len(messages))
+            MESSAGES_PROCESSED.inc(len(messages) - self.last_batch_rejected - self.last_batch_skipped)
+            mark_batch()
 
-        for product in products_info:
-            self._process_product_info(user_id, product)
+            # Оффсеты фиксируются только после записи в БД
+            if messages:
+                self._uncommitted_batches += 1
+            if self._uncommitted_batches >= self._commit_every:
+                self._consumer.commit()
+                self._uncommitted_batches = 0
+        except Exception:
+            self._consumer.rewind()
+            self._uncommitted_batches = 0
+            raise
 
-    def _process_product_info(self, user_id: str, product: Tuple[str, str, str, str, int]) -> None:
-        self._cdm_repository.user_product_counters_insert(user_id, product[0], product[1], product[4])
-        self._cdm_repository.user_category_counters_insert(user_id, product[2], product[3])
+        self._logger.info(f"{datetime.utcnow()}: consumed: {len(messages)}, orders: {len(applied)}, "
+                          f"rejected: {self.last_batch_rejected}, skipped: {self.last_batch_skipped}")
 
     def run(self) -> None:
         self._logger.info(f"{datetime.utcnow()}: START")
 
-        for _ in range(self._batch_size):
-            msg = self._consumer.consume()
-            if not msg:
-                break
-            self._process_message(msg)
+        messages = self._consumer.consume_batch(self._batch_size, timeout=3.0)
+        self.process_batch(messages)
 
         self._logger.info(f"{datetime.utcnow()}: FINISH")
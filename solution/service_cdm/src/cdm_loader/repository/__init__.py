@@ -1 +1,2 @@
-from .cdm_repository import CdmRepository  # noqa
\ No newline at end of file
+from .cdm_repository import CdmRepository, DeltaRows  # noqa
+from .cdm_repository_async import AsyncCdmRepository  # noqa
@@ -1,12 +1,87 @@
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
+from psycopg import Cursor, sql
+
+from lib.metrics import timed
 from lib.pg import PgConnect
 
 
+USER_PRODUCT_COUNTERS_QUERY = """
+    insert into cdm.user_product_counters (user_id, product_id, product_name, order_cnt)
+    values (%(user_id)s, %(product_id)s, %(product_name)s, %(order_cnt)s)
+    on conflict(user_id, product_id) do update
+    set order_cnt = user_product_counters.order_cnt + excluded.order_cnt;
+"""
+
+USER_CATEGORY_COUNTERS_QUERY = """
+    insert into cdm.user_category_counters (user_id, category_id, category_name, order_cnt)
+    values (%(user_id)s, %(category_id)s, %(category_name)s, 1)
+    on conflict(user_id, category_id) do update
+    set order_cnt = user_category_counters.order_cnt + 1;
+"""
+
+USER_PRODUCT_COUNTERS_UPSERT = """
+    insert into cdm.user_product_counters (user_id, product_id, product_name, order_cnt)
+    values {values}
+    on conflict(user_id, product_id) do update
+    set order_cnt = user_product_counters.order_cnt + excluded.order_cnt;
+"""
+
+USER_CATEGORY_COUNTERS_UPSERT = """
+    insert into cdm.user_category_counters (user_id, category_id, category_name, order_cnt)
+    values {values}
+    on conflict(user_id, category_id) do update
+    set order_cnt = user_category_counters.order_cnt + excluded.order_cnt;
+"""
+
+PROCESSED_ORDERS_DDL = """
+    create table if not exists cdm.processed_orders (
+        order_id uuid primary key,
+        processed_at timestamp not null default now()
+    );
+    create index if not exists processed_orders_processed_at_idx on cdm.processed_orders (processed_at);
+"""
+
+# Возвращает только заказы, которых ещё не было: их приращения и применяются той же транзакцией
+PROCESSED_ORDERS_INSERT = """
+    insert into cdm.processed_orders (order_id)
+    select unnest(%s::uuid[])
+    on conflict (order_id) do nothing
+    returning order_id;
+"""
+
+# Окно дедупликации: повтор заказа, применённого раньше retention_hours назад, снова увеличит счётчики
+PROCESSED_ORDERS_PURGE = """
+    delete from cdm.processed_orders
+    where processed_at < now() - make_interval(hours => %s);
+"""
+
+# Строки приращений (user_id, id, name, order_cnt) для продуктов и категорий
+DeltaRows = Tuple[List[Tuple[str, str, str, int]], List[Tuple[str, str, str, int]]]
+
+# Ограничение на число строк в одном multi-row upsert (лимит параметров Postgres - 65535).
+MAX_UPSERT_ROWS = 1000
+
+
 class CdmRepository:
-    def __init__(self, db: PgConnect) -> None:
+    def __init__(self, db: PgConnect, dedup_orders: bool = True) -> None:
         self._db = db
+        # Учёт применённых заказов в cdm.processed_orders: повторная доставка не увеличивает счётчики
+        self._dedup_orders = dedup_orders
+
+    @staticmethod
+    def create_tables(db: PgConnect) -> None:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(PROCESSED_ORDERS_DDL)
+
+    def purge_processed_orders(self, retention_hours: int) -> int:
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                with timed('db_processed_orders_purge'):
+                    cur.execute(PROCESSED_ORDERS_PURGE, (retention_hours,))
+                return cur.rowcount
 
     def _execute_query(self, query: str, params: Dict[str, Any]) -> None:
         with self._db.connection() as conn:
@@ -14,30 +89,76 @@ class CdmRepository:
                 cur.execute(query, params)
 
     def user_product_counters_insert(self, user_id: str, product_id: str, product_name: str, order_cnt: int) -> None:
-        query = """
-            insert into cdm.user_product_counters (user_id, product_id, product_name, order_cnt)
-            values (%(user_id)s, %(product_id)s, %(product_name)s, %(order_cnt)s)
-            on conflict(user_id, product_id) do update
-            set order_cnt = user_product_counters.order_cnt + excluded.order_cnt;
-        """
         params = {
             'user_id': user_id,
             'product_id': product_id,
             'product_name': product_name,
             'order_cnt': order_cnt
         }
-        self._execute_query(query, params)
+        self._execute_query(USER_PRODUCT_COUNTERS_QUERY, params)
 
     def user_category_counters_insert(self, user_id: str, category_id: str, category_name: str) -> None:
-        query = """
-            insert into cdm.user_category_counters (user_id, category_id, category_name, order_cnt)
-            values (%(user_id)s, %(category_id)s, %(category_name)s, 1)
-            on conflict(user_id, category_id) do update
-            set order_cnt = user_category_counters.order_cnt + 1;
-        """
         params = {
             'user_id': user_id,
             'category_id': category_id,
             'category_name': category_name
         }
-        self._execute_query(query, params)
+        self._execute_query(USER_CATEGORY_COUNTERS_QUERY, params)
+
+    @staticmethod
+    def upsert_statements(query: str, rows: Sequence[Tuple[Any, ...]]) -> Iterator[Tuple[sql.Composed, List[Any]]]:
+        # Ключи в rows должны быть уникальны: do update не может изменить одну строку дважды.
+        for start in range(0, len(rows), MAX_UPSERT_ROWS):
+            chunk = rows[start:start + MAX_UPSERT_ROWS]
+            placeholders = sql.SQL("({})").format(sql.SQL(", ").join(sql.Placeholder() * len(chunk[0])))
+            statement = sql.SQL(query).format(values=sql.SQL(", ").join([placeholders] * len(chunk)))
+            yield statement, [value for row in chunk for value in row]
+
+    def _upsert_rows(self, cur: Cursor, query: str, rows: Sequence[Tuple[Any, ...]]) -> None:
+        for statement, params in self.upsert_statements(query, rows):
+            cur.execute(statement, params)
+
+    def _write_counters(self,
+                        cur: Cursor,
+                        product_counters: Sequence[Tuple[str, str, str, int]],
+                        category_counters: Sequence[Tuple[str, str, str, int]]) -> None:
+        if product_counters:
+            with timed('db_user_product_counters'):
+                self._upsert_rows(cur, USER_PRODUCT_COUNTERS_UPSERT, product_counters)
+        if category_counters:
+            with timed('db_user_category_counters'):
+                self._upsert_rows(cur, USER_CATEGORY_COUNTERS_UPSERT, category_counters)
+
+    def counters_insert_batch(self,
+                              product_counters: Sequence[Tuple[str, str, str, int]],
+                              category_counters: Sequence[Tuple[str, str, str, int]]) -> None:
+        """Применяет агрегированные приращения: строки (user_id, id, name, order_cnt)."""
+        # Все счётчики пачки применяются в одной транзакции, по одному upsert на таблицу.
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                self._write_counters(cur, product_counters, category_counters)
+
+    @staticmethod
+    def _new_orders(cur: Cursor, order_ids: Sequence[str]) -> Set[str]:
+        with timed('db_processed_orders'):
+            cur.execute(PROCESSED_ORDERS_INSERT, (list(order_ids),))
+            return {str(order_id) for order_id, in cur.fetchall()}
+
+    def counters_apply_orders(self,
+                              order_ids: Sequence[str],
+                              delta_rows: Callable[[Optional[Set[str]]], DeltaRows]) -> int:
+        """Применяет приращения только тех заказов, которые ещё не применялись.
+
+        Ключи заказов отмечаются в cdm.processed_orders той же транзакцией, что и
+        upsert счётчиков. delta_rows получает множество новых заказов (None - учёт
+        выключен) и возвращает строки приращений по ним. Возвращает число заказов,
+        применённых раньше и пропущенных теперь. Повтор распознаётся, пока отметка
+        заказа не удалена purge_processed_orders, то есть в окне retention_hours.
+        """
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                new_orders = None
+                if self._dedup_orders and order_ids:
+                    new_orders = self._new_orders(cur, order_ids)
+                self._write_counters(cur, *delta_rows(new_orders))
+        return len(order_ids) - len(new_orders) if new_orders is not None else 0
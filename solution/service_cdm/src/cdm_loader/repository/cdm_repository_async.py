@@ -0,0 +1,52 @@
+from typing import Any, Callable, Optional, Sequence, Set, Tuple
+
+from psycopg import AsyncCursor
+
+from lib.metrics import timed
+from lib.pg import AsyncPgConnect
+from .cdm_repository import (PROCESSED_ORDERS_INSERT, USER_CATEGORY_COUNTERS_UPSERT, USER_PRODUCT_COUNTERS_UPSERT,
+                             CdmRepository, DeltaRows)
+
+
+class AsyncCdmRepository:
+    """Запись счётчиков CdmRepository для asyncio-конвейера на AsyncConnection."""
+
+    def __init__(self, db: AsyncPgConnect, dedup_orders: bool = True) -> None:
+        self._db = db
+        self._dedup_orders = dedup_orders
+
+    @staticmethod
+    async def _upsert_rows(cur: AsyncCursor, query: str, rows: Sequence[Tuple[Any, ...]]) -> None:
+        for statement, params in CdmRepository.upsert_statements(query, rows):
+            await cur.execute(statement, params)
+
+    async def _write_counters(self,
+                              cur: AsyncCursor,
+                              product_counters: Sequence[Tuple[str, str, str, int]],
+                              category_counters: Sequence[Tuple[str, str, str, int]]) -> None:
+        if product_counters:
+            with timed('db_user_product_counters'):
+                await self._upsert_rows(cur, USER_PRODUCT_COUNTERS_UPSERT, product_counters)
+        if category_counters:
+            with timed('db_user_category_counters'):
+                await self._upsert_rows(cur, USER_CATEGORY_COUNTERS_UPSERT, category_counters)
+
+    async def counters_insert_batch(self,
+                                    product_counters: Sequence[Tuple[str, str, str, int]],
+                                    category_counters: Sequence[Tuple[str, str, str, int]]) -> None:
+        async with self._db.connection() as conn:
+            async with conn.cursor() as cur:
+                await self._write_counters(cur, product_counters, category_counters)
+
+    async def counters_apply_orders(self,
+                                    order_ids: Sequence[str],
+                                    delta_rows: Callable[[Optional[Set[str]]], DeltaRows]) -> int:
+        async with self._db.connection() as conn:
+            async with conn.cursor() as cur:
+                new_orders = None
+                if self._dedup_orders and order_ids:
+                    with timed('db_processed_orders'):
+                        await cur.execute(PROCESSED_ORDERS_INSERT, (list(order_ids),))
+                        new_orders = {str(order_id) for order_id, in await cur.fetchall()}
+                await self._write_counters(cur, *delta_rows(new_orders))
+        return len(order_ids) - len(new_orders) if new_orders is not None else 0
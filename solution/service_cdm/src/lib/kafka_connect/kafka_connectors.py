@@ -1,15 +1,97 @@
-import json
-from typing import Dict, Optional
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
-from confluent_kafka import Consumer, Producer
+from confluent_kafka import OFFSET_BEGINNING, Consumer, KafkaError, KafkaException, Producer, TopicPartition
+
+from lib.metrics import MESSAGES_CONSUMED, timed
+from .serializers import DEFAULT_SERIALIZER
+
+
+logger = logging.getLogger(__name__)
 
 
 def error_callback(err):
-    print('Something went wrong: {}'.format(err))
+    logger.error('Something went wrong: {}'.format(err))
+
+
+class KafkaDeliveryError(Exception):
+    pass
+
+
+class KafkaMessage:
+    __slots__ = ('topic', 'partition', 'offset', 'key', 'headers', 'value', 'serializer')
+
+    def __init__(self,
+                 topic: str,
+                 partition: int,
+                 offset: int,
+                 key: Optional[bytes],
+                 headers: Optional[List[Tuple[str, bytes]]],
+                 value: bytes,
+                 serializer=DEFAULT_SERIALIZER) -> None:
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.key = key
+        self.headers = headers
+        self.value = value
+        self.serializer = serializer
+
+    def payload(self) -> Dict:
+        # Разбор прямо из буфера сообщения, без промежуточного str
+        return self.serializer.loads(self.value)
+
+
+class DeliveryScope:
+    """Результаты доставки сообщений, отправленных одним процессором (воркером, полосой).
+
+    Продюсер librdkafka общий, и flush() одного потока вызывает delivery callback-и
+    сообщений других потоков. Поэтому ошибки и число недоставленных сообщений
+    учитываются по scope: flush() проверяет только сообщения своего scope.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._errors: List[KafkaError] = []
+
+    def sent(self) -> None:
+        with self._lock:
+            self._pending += 1
+
+    def on_delivery(self, err: Optional[KafkaError], msg) -> None:
+        with self._lock:
+            self._pending -= 1
+            if err is not None:
+                self._errors.append(err)
+
+    def take(self) -> Tuple[int, List[KafkaError]]:
+        with self._lock:
+            errors, self._errors = self._errors, []
+            return self._pending, errors
 
 
 class KafkaProducer:
-    def __init__(self, host: str, port: int, user: str, password: str, topic: str, cert_path: str) -> None:
+    """Неблокирующий продюсер: produce только ставит сообщение в очередь librdkafka.
+
+    Результаты доставки собираются в delivery callback, flush() на границе пачки
+    дожидается отправки и поднимает KafkaDeliveryError, если что-то не доставлено.
+    Оффсеты исходного топика можно фиксировать только после успешного flush().
+    Без явного DeliveryScope доставка учитывается отдельно для каждого потока.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 user: str,
+                 password: str,
+                 topic: str,
+                 cert_path: str,
+                 linger_ms: int = 50,
+                 batch_size: int = 131072,
+                 compression: str = 'lz4',
+                 serializer=DEFAULT_SERIALIZER) -> None:
         params = {
             'bootstrap.servers': f'{host}:{port}',
             'security.protocol': 'SASL_SSL',
@@ -18,14 +100,52 @@ class KafkaProducer:
             'sasl.username': user,
             'sasl.password': password,
             'error_cb': error_callback,
+            'linger.ms': linger_ms,
+            'batch.size': batch_size,
+            'compression.type': compression,
+            'enable.idempotence': True,
         }
 
         self.topic = topic
+        self.serializer = serializer
         self.p = Producer(params)
+        self._local = threading.local()
+
+    @staticmethod
+    def delivery_scope() -> DeliveryScope:
+        return DeliveryScope()
+
+    def _scope(self, scope: Optional[DeliveryScope]) -> DeliveryScope:
+        if scope is not None:
+            return scope
+        local_scope = getattr(self._local, 'scope', None)
+        if local_scope is None:
+            local_scope = self._local.scope = DeliveryScope()
+        return local_scope
+
+    def produce(self, payload: Dict, scope: Optional[DeliveryScope] = None) -> None:
+        self.produce_value(self.serializer.dumps(payload), scope)
 
-    def produce(self, payload: Dict) -> None:
-        self.p.produce(self.topic, json.dumps(payload))
-        self.p.flush(10)
+    def produce_value(self, value: bytes, scope: Optional[DeliveryScope] = None) -> None:
+        """Отправляет уже сериализованное сообщение, например из outbox."""
+        scope = self._scope(scope)
+        while True:
+            try:
+                self.p.produce(self.topic, value, on_delivery=scope.on_delivery)
+                break
+            except BufferError:
+                # Локальная очередь заполнена: ждём отправки части сообщений
+                self.p.poll(1)
+        scope.sent()
+        self.p.poll(0)
+
+    def flush(self, timeout: float = 30.0, scope: Optional[DeliveryScope] = None) -> None:
+        self.p.flush(timeout)
+        pending, errors = self._scope(scope).take()
+        if errors:
+            raise KafkaDeliveryError(f"{len(errors)} messages were not delivered, first error: {errors[0]}")
+        if pending > 0:
+            raise KafkaDeliveryError(f"{pending} messages were not delivered in {timeout}s")
 
 
 class KafkaConsumer:
@@ -36,7 +156,9 @@ class KafkaConsumer:
                  password: str,
                  topic: str,
                  group: str,
-                 cert_path: str
+                 cert_path: str,
+                 serializer=DEFAULT_SERIALIZER,
+                 max_prefetch_kbytes: int = 16384
                  ) -> None:
         params = {
             'bootstrap.servers': f'{host}:{port}',
@@ -48,12 +170,14 @@ class KafkaConsumer:
             'group.id': group,  # '',
             'auto.offset.reset': 'earliest',
             'enable.auto.commit': False,
+            'queued.max.messages.kbytes': max_prefetch_kbytes,
             'error_cb': error_callback,
             'debug': 'all',
             'client.id': 'someclientkey'
         }
 
         self.topic = topic
+        self.serializer = serializer
         self.c = Consumer(params)
         self.c.subscribe([topic])
 
@@ -63,5 +187,84 @@ class KafkaConsumer:
             return None
         if msg.error():
             raise Exception(msg.error())
-        val = msg.value().decode()
-        return json.loads(val)
+        return self.serializer.loads(msg.value())
+
+    def consume_batch(self, num_messages: int, timeout: float = 1.0) -> List[KafkaMessage]:
+        messages = []
+        with timed('poll'):
+            raw = self.c.consume(num_messages=num_messages, timeout=timeout)
+        for msg in raw:
+            if msg.error():
+                if msg.error().code() == KafkaError._PARTITION_EOF:
+                    continue
+                raise Exception(msg.error())
+            messages.append(KafkaMessage(
+                msg.topic(), msg.partition(), msg.offset(), msg.key(), msg.headers(), msg.value(), self.serializer
+            ))
+        MESSAGES_CONSUMED.inc(len(messages))
+        return messages
+
+    def commit(self) -> None:
+        # Синхронно фиксируем позиции всех прочитанных сообщений.
+        try:
+            with timed('commit'):
+                self.c.commit(asynchronous=False)
+        except KafkaException as e:
+            if e.args[0].code() != KafkaError._NO_OFFSET:
+                raise
+
+    def commit_offsets(self, offsets: Dict[Tuple[str, int], int]) -> None:
+        # Явные оффсеты (следующий для чтения) по партициям, для параллельной обработки.
+        if not offsets:
+            return
+        with timed('commit'):
+            self.c.commit(
+                offsets=[TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()],
+                asynchronous=False
+            )
+
+    def set_rebalance_callbacks(self,
+                                on_assign: Optional[Callable] = None,
+                                on_revoke: Optional[Callable] = None) -> None:
+        kwargs = {}
+        if on_assign is not None:
+            kwargs['on_assign'] = on_assign
+        if on_revoke is not None:
+            kwargs['on_revoke'] = on_revoke
+        self.c.subscribe([self.topic], **kwargs)
+
+    def rewind(self, partitions: Optional[Iterable[Tuple[str, int]]] = None) -> None:
+        # Возвращаемся к последним зафиксированным оффсетам, чтобы необработанная пачка
+        # была прочитана заново, а не пропущена следующим commit.
+        # partitions - только эти партиции из назначенных, по умолчанию все.
+        assignment = self.c.assignment()
+        if partitions is not None:
+            keys = set(partitions)
+            assignment = [tp for tp in assignment if (tp.topic, tp.partition) in keys]
+        if not assignment:
+            return
+        for tp in self.c.committed(assignment, timeout=10):
+            if tp.offset < 0:
+                tp.offset = OFFSET_BEGINNING
+            self.c.seek(tp)
+
+    def lag(self) -> Dict[Tuple[str, int], int]:
+        # Отставание по назначенным партициям: high watermark из последнего fetch минус позиция чтения.
+        lag = {}
+        for tp in self.c.position(self.c.assignment()):
+            low, high = self.c.get_watermark_offsets(tp, cached=True)
+            if high < 0:
+                continue
+            # Позиции ещё нет - читать будем с начала партиции (auto.offset.reset=earliest)
+            position = tp.offset if tp.offset >= 0 else max(low, 0)
+            lag[(tp.topic, tp.partition)] = max(0, high - position)
+        return lag
+
+    def pause(self) -> None:
+        self.c.pause(self.c.assignment())
+
+    def resume(self) -> None:
+        self.c.resume(self.c.assignment())
+
+    def close(self) -> None:
+        self.c.close()
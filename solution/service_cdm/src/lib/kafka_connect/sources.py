@@ -0,0 +1,147 @@
+import glob
+import gzip
+import json
+import os
+import time
+from itertools import islice
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Protocol, Sequence, Tuple, Union
+
+from lib.metrics import MESSAGES_CONSUMED
+from .kafka_connectors import KafkaMessage
+from .serializers import DEFAULT_SERIALIZER
+
+
+class MessageSource(Protocol):
+    """Источник сообщений для процессоров: KafkaConsumer или FileSource."""
+
+    topic: str
+
+    def consume_batch(self, num_messages: int, timeout: float = 1.0) -> List[KafkaMessage]:
+        ...
+
+    def commit(self) -> None:
+        ...
+
+    def commit_offsets(self, offsets: Dict[Tuple[str, int], int]) -> None:
+        ...
+
+    def rewind(self, partitions: Optional[Iterable[Tuple[str, int]]] = None) -> None:
+        ...
+
+    def pause(self) -> None:
+        ...
+
+    def resume(self) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class FileSource:
+    """Реплей дампа топика из JSONL-файлов (в том числе .gz) без брокера.
+
+    Одна строка - значение одного сообщения. Каждый файл играет роль партиции
+    (номер - индекс файла в отсортированном списке), номер строки - роль оффсета.
+    commit записывает позиции в checkpoint-файл, и при следующем запуске чтение
+    продолжается с них. Файлы читаются потоково, в памяти только текущая пачка.
+    """
+
+    def __init__(self,
+                 paths: Union[str, Sequence[str]],
+                 topic: str = 'replay',
+                 checkpoint_path: Optional[str] = None,
+                 serializer=DEFAULT_SERIALIZER) -> None:
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(paths)) or [paths]
+        self.topic = topic
+        self.serializer = serializer
+        self._paths = list(paths)
+        self._checkpoint_path = checkpoint_path
+        self._committed: Dict[int, int] = self._load_checkpoint()
+        self._position: Dict[int, int] = dict(self._committed)
+        self.exhausted = False
+        self._messages = self._read()
+
+    @staticmethod
+    def _open(path: str) -> IO[bytes]:
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rb')
+        return open(path, 'rb')
+
+    def _load_checkpoint(self) -> Dict[int, int]:
+        if not self._checkpoint_path or not os.path.exists(self._checkpoint_path):
+            return {}
+        with open(self._checkpoint_path) as f:
+            saved = json.load(f)
+        return {partition: saved[path] for partition, path in enumerate(self._paths) if path in saved}
+
+    def _save_checkpoint(self) -> None:
+        if not self._checkpoint_path:
+            return
+        # Запись через временный файл: прерванный commit не портит checkpoint
+        tmp_path = f'{self._checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({self._paths[partition]: offset for partition, offset in self._committed.items()}, f)
+        os.replace(tmp_path, self._checkpoint_path)
+
+    def _read(self) -> Iterator[KafkaMessage]:
+        for partition, path in enumerate(self._paths):
+            start = self._position.get(partition, 0)
+            with self._open(path) as f:
+                for offset, line in enumerate(f):
+                    if offset < start:
+                        continue
+                    line = line.strip()
+                    if line:
+                        yield KafkaMessage(self.topic, partition, offset, None, None, line, self.serializer)
+        self.exhausted = True
+
+    def consume_batch(self, num_messages: int, timeout: float = 1.0) -> List[KafkaMessage]:
+        messages = list(islice(self._messages, num_messages))
+        if not messages and self.exhausted:
+            # Как poll пустого топика: ждём timeout, чтобы цикл чтения не крутился вхолостую
+            time.sleep(timeout)
+        for msg in messages:
+            self._position[msg.partition] = msg.offset + 1
+        MESSAGES_CONSUMED.inc(len(messages))
+        return messages
+
+    def consume(self, timeout: float = 3.0) -> Optional[Dict]:
+        messages = self.consume_batch(1, timeout)
+        return messages[0].payload() if messages else None
+
+    def commit(self) -> None:
+        self._committed = dict(self._position)
+        self._save_checkpoint()
+
+    def commit_offsets(self, offsets: Dict[Tuple[str, int], int]) -> None:
+        if not offsets:
+            return
+        for (_, partition), offset in offsets.items():
+            self._committed[partition] = max(self._committed.get(partition, 0), offset)
+        self._save_checkpoint()
+
+    def rewind(self, partitions: Optional[Iterable[Tuple[str, int]]] = None) -> None:
+        # Как seek к зафиксированным оффсетам в Kafka: файлы перечитываются с checkpoint.
+        # Файлы читаются последовательно, поэтому возвращаются все партиции, а не только partitions.
+        self._messages.close()
+        self._position = dict(self._committed)
+        self.exhausted = False
+        self._messages = self._read()
+
+    def lag(self) -> Dict[Tuple[str, int], int]:
+        # Длина файлов заранее неизвестна, отставание не считается
+        return {}
+
+    def set_rebalance_callbacks(self, on_assign=None, on_revoke=None) -> None:
+        pass
+
+    def pause(self) -> None:
+        pass
+
+    def resume(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._messages.close()
@@ -0,0 +1,39 @@
+from typing import Any, Dict, Tuple
+
+from .metrics import seconds_since_last_batch
+
+
+class ReadinessProbe:
+    """Готовность пода: БД доступна и обработка не стоит.
+
+    Пачек может не быть просто потому, что топик пуст, поэтому время с последней
+    пачки проверяется только при ненулевом отставании. Само отставание готовность
+    не снимает: на пике его разбирает масштабирование, а не вывод подов из сервиса.
+    Оно только отдаётся в ответе и в метриках.
+    """
+
+    def __init__(self, consumer, db, max_batch_age: float = 300.0, db_timeout: float = 2.0) -> None:
+        self._consumer = consumer
+        self._db = db
+        self._max_batch_age = max_batch_age
+        self._db_timeout = db_timeout
+
+    def _db_ok(self) -> bool:
+        try:
+            self._db.ping(self._db_timeout)
+        except Exception:
+            return False
+        return True
+
+    def check(self) -> Tuple[bool, Dict[str, Any]]:
+        lag = sum(self._consumer.lag().values())
+        batch_age = seconds_since_last_batch()
+        db_ok = self._db_ok()
+
+        ready = db_ok and (lag == 0 or batch_age <= self._max_batch_age)
+        return ready, {
+            'ready': ready,
+            'lag': lag,
+            'seconds_since_last_batch': round(batch_age, 1),
+            'db': db_ok
+        }
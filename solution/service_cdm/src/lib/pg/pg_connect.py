@@ -1,12 +1,23 @@
-from contextlib import contextmanager
-from typing import Generator
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncGenerator, Dict, Generator, Optional
 
 import psycopg
-from psycopg import Connection
+from psycopg import AsyncConnection, Connection
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 
 
 class PgConnect:
-    def __init__(self, host: str, port: int, db_name: str, user: str, pw: str, sslmode: str = "require") -> None:
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 db_name: str,
+                 user: str,
+                 pw: str,
+                 sslmode: str = "require",
+                 pool_min_size: int = 0,
+                 pool_max_size: int = 0,
+                 pool_max_lifetime: float = 3600.0,
+                 pool_max_idle: float = 600.0) -> None:
         self.host = host
         self.port = port
         self.db_name = db_name
@@ -14,6 +25,22 @@ class PgConnect:
         self.pw = pw
         self.sslmode = sslmode
 
+        # pool_max_size = 0 - без пула, новое соединение на каждый вызов connection().
+        self._pool: Optional[ConnectionPool] = None
+        if pool_max_size > 0:
+            self._pool = ConnectionPool(
+                self.url(),
+                min_size=min(pool_min_size, pool_max_size),
+                max_size=pool_max_size,
+                max_lifetime=pool_max_lifetime,
+                max_idle=pool_max_idle,
+                # Соединение проверяется при выдаче из пула: после failover мёртвые соединения
+                # отбрасываются, а новые благодаря target_session_attrs идут на новый мастер.
+                check=ConnectionPool.check_connection,
+                name=f"{self.host}:{self.port}/{self.db_name}",
+                open=True
+            )
+
     def url(self) -> str:
         return """
             host={host}
@@ -31,8 +58,18 @@ class PgConnect:
             pw=self.pw,
             sslmode=self.sslmode)
 
+    @property
+    def pooled(self) -> bool:
+        return self._pool is not None
+
     @contextmanager
     def connection(self) -> Generator[Connection, None, None]:
+        if self._pool is not None:
+            # Пул сам делает commit при успешном выходе и rollback при исключении.
+            with self._pool.connection() as conn:
+                yield conn
+            return
+
         conn = psycopg.connect(self.url())
         try:
             yield conn
@@ -42,3 +79,68 @@ class PgConnect:
             raise e
         finally:
             conn.close()
+
+    def ping(self, timeout: float = 2.0) -> None:
+        # Отдельное соединение вне пула: проверка не ждёт, пока воркеры вернут соединения,
+        # и не висит дольше timeout ни на подключении, ни на запросе.
+        with psycopg.connect(self.url(),
+                             connect_timeout=max(1, int(timeout)),
+                             options=f'-c statement_timeout={int(timeout * 1000)}',
+                             autocommit=True) as conn:
+            conn.execute('SELECT 1')
+
+    def pool_stats(self) -> Dict[str, int]:
+        if self._pool is None:
+            return {}
+        return self._pool.get_stats()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+
+
+class AsyncPgConnect:
+    """Асинхронный вариант PgConnect на AsyncConnectionPool для asyncio-конвейера.
+
+    Пул открывается при первом запросе соединения, уже внутри event loop.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 db_name: str,
+                 user: str,
+                 pw: str,
+                 sslmode: str = "require",
+                 pool_min_size: int = 1,
+                 pool_max_size: int = 4,
+                 pool_max_lifetime: float = 3600.0,
+                 pool_max_idle: float = 600.0) -> None:
+        self._conninfo = PgConnect(host, port, db_name, user, pw, sslmode).url()
+        self._pool = AsyncConnectionPool(
+            self._conninfo,
+            min_size=min(pool_min_size, pool_max_size),
+            max_size=pool_max_size,
+            max_lifetime=pool_max_lifetime,
+            max_idle=pool_max_idle,
+            check=AsyncConnectionPool.check_connection,
+            name=f"{host}:{port}/{db_name}-async",
+            open=False
+        )
+        self._opened = False
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncGenerator[AsyncConnection, None]:
+        if not self._opened:
+            await self._pool.open()
+            self._opened = True
+        # Как и синхронный пул: commit при успешном выходе, rollback при исключении.
+        async with self._pool.connection() as conn:
+            yield conn
+
+    def pool_stats(self) -> Dict[str, int]:
+        return self._pool.get_stats()
+
+    async def close(self) -> None:
+        if self._opened:
+            await self._pool.close()
@@ -1,11 +1,19 @@
 import logging
+import signal
+import sys
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask
 
 from app_config import AppConfig
+from lib.kafka_connect import AsyncKafkaProducer, AsyncPipeline, StreamingLoop
+from lib.metrics import ReadinessProbe, metrics_response, register_consumer, register_pg_pool
+from dds_loader.dds_async_processor import AsyncDdsMessageProcessor
 from dds_loader.dds_message_processor_job import DdsMessageProcessor
-from dds_loader.repository import DdsRepository
+from dds_loader.dds_outbox_relay import DdsOutboxRelay
+from dds_loader.dds_parallel_runner import DdsParallelRunner
+from dds_loader.repository import (KEY_GENERATOR, AsyncDdsRepository, DdsKnownKeys, DdsOutbox, DdsRepository,
+                                   DdsSatelliteCache)
 
 app = Flask(__name__)
 
@@ -17,20 +25,145 @@ def hello_world():
     return 'healthy'
 
 
+@app.get('/metrics')
+def metrics():
+    return metrics_response()
+
+
+readiness = None
+
+
+@app.get('/ready')
+def ready():
+    # Пока потребитель не создан, под не готов
+    if readiness is None:
+        return {'ready': False}, 503
+    is_ready, state = readiness.check()
+    return state, 200 if is_ready else 503
+
+
 if __name__ == '__main__':
     app.logger.setLevel(logging.DEBUG)
 
     config = AppConfig()
 
-    proc = DdsMessageProcessor( 
-        consumer=config.kafka_consumer(),
-        producer=config.kafka_producer(),
-        dds_repository=DdsRepository(config.pg_warehouse_db()),
-        logger=app.logger
-    )
+    KEY_GENERATOR.cache.set_max_size(config.dds_key_cache_size)
+
+    consumer = config.message_source()
+    producer = config.kafka_producer()
+    db = config.pg_warehouse_db()
+    register_consumer(consumer)
+    register_pg_pool(db)
+    readiness = ReadinessProbe(consumer, db, config.ready_max_batch_age_s)
+
+    known_keys = None
+    if config.dds_known_keys_size > 0:
+        known_keys = DdsKnownKeys(config.dds_known_keys_size)
+        known_keys.warm_up(db)
+
+    satellites = None
+    if config.dds_satellite_cache_size > 0:
+        satellites = DdsSatelliteCache(config.dds_satellite_cache_size)
+
+    outbox = None
+    relay = None
+    if config.dds_outbox:
+        outbox = DdsOutbox(producer.serializer)
+        DdsOutbox.create_table(db)
+        relay = DdsOutboxRelay(
+            db=db,
+            producer=producer,
+            logger=app.logger,
+            batch_size=config.outbox_relay_batch_size,
+            poll_interval=config.outbox_relay_interval_ms / 1000,
+            retention_hours=config.outbox_retention_hours
+        )
+        relay.start()
+
+    dead_letters = config.dead_letter_sink()
+    # Один пул процессов сборки на все процессоры
+    process_builder = config.process_builder()
+
+    def create_processor() -> DdsMessageProcessor:
+        return DdsMessageProcessor(
+            consumer=consumer,
+            producer=producer,
+            dds_repository=DdsRepository(db, known_keys, satellites, outbox),
+            logger=app.logger,
+            batch_size=config.batch_size,
+            commit_every=config.kafka_commit_every,
+            validate_payload=config.dds_validate_payload,
+            dead_letters=dead_letters,
+            retry_policy=config.retry_policy(),
+            process_builder=process_builder,
+            columnar_build=config.dds_columnar_build
+        )
+
+    if config.processing_mode == 'scheduler':
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(func=create_processor().run, trigger="interval", seconds=25)
+        scheduler.start()
+    else:
+        if config.processing_mode == 'parallel':
+            loop = DdsParallelRunner(
+                consumer=consumer,
+                processor_factory=create_processor,
+                logger=app.logger,
+                workers=config.dds_workers,
+                shard_by=config.dds_shard_by,
+                batch_size=config.batch_size,
+                queue_size=config.dds_queue_size,
+                sizer_factory=config.batch_sizer,
+                max_in_flight=config.dds_max_in_flight,
+                max_retries=config.dds_worker_retries
+            )
+        elif config.processing_mode == 'async':
+            async_db = config.async_pg_warehouse_db()
+
+            def create_stages():
+                # Своя обёртка продюсера на полосу: ошибки доставки не попадают в чужую пачку
+                return AsyncDdsMessageProcessor(
+                    producer=AsyncKafkaProducer(producer),
+                    dds_repository=AsyncDdsRepository(async_db, known_keys, satellites, outbox),
+                    logger=app.logger,
+                    validate_payload=config.dds_validate_payload,
+                    dead_letters=dead_letters,
+                    retry_policy=config.retry_policy(),
+                    process_builder=process_builder,
+                    columnar_build=config.dds_columnar_build
+                ).stages()
+
+            loop = AsyncPipeline(
+                source=consumer,
+                stages_factory=create_stages,
+                logger=app.logger,
+                lanes=config.async_lanes,
+                batch_size=config.batch_size,
+                queue_size=config.async_queue_size,
+                max_retries=config.async_retries,
+                on_close=async_db.close
+            )
+        else:
+            loop = StreamingLoop(
+                consumer=consumer,
+                handler=create_processor().process_batch,
+                logger=app.logger,
+                batch_size=config.batch_size,
+                linger_ms=config.stream_linger_ms,
+                sizer=config.batch_sizer()
+            )
+        loop.start()
+
+        def shutdown(signum, frame):
+            # Дожидаемся текущей пачки и commit оффсетов, затем выходим
+            app.logger.info("SIGTERM received, stopping consumer")
+            loop.stop()
+            if relay is not None:
+                relay.stop()
+            if process_builder is not None:
+                process_builder.close()
+            sys.exit(0)
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=proc.run, trigger="interval", seconds=25)
-    scheduler.start()
+        signal.signal(signal.SIGTERM, shutdown)
 
     app.run(debug=True, host='0.0.0.0', use_reloader=False)
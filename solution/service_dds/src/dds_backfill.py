@@ -0,0 +1,112 @@
+import argparse
+import logging
+from datetime import datetime
+
+from app_config import AppConfig
+from lib.kafka_connect import FileSource, KafkaMessage, get_serializer
+from dds_loader.dds_filter import is_closed_order
+from dds_loader.repository import DdsBatch, DdsBulkLoader, DdsColumnarBuilder
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Перестроение DDS из реплея топика или его дампа через COPY.')
+    parser.add_argument('--group', default='dds-backfill',
+                        help='Consumer group реплея, отдельная от группы сервиса.')
+    parser.add_argument('--chunk-size', type=int, default=5000,
+                        help='Сколько сообщений загружать одной транзакцией.')
+    parser.add_argument('--max-messages', type=int, default=0,
+                        help='Остановиться после N сообщений (0 - до конца топика).')
+    parser.add_argument('--idle-polls', type=int, default=3,
+                        help='Сколько пустых poll подряд считать концом топика.')
+    parser.add_argument('--source-path',
+                        help='Читать не из Kafka, а из дампа топика: JSONL или .gz, можно маской.')
+    parser.add_argument('--checkpoint',
+                        help='Файл позиций для реплея из дампа, чтобы продолжить после прерывания.')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('dds_backfill')
+
+    config = AppConfig()
+    if args.source_path:
+        source = FileSource(args.source_path, checkpoint_path=args.checkpoint,
+                            serializer=get_serializer(config.kafka_serializer))
+    else:
+        source = config.kafka_consumer(group=args.group)
+    loader = DdsBulkLoader(config.pg_warehouse_db())
+    builder = DdsColumnarBuilder()
+    dead_letters = config.dead_letter_sink()
+
+    def reject(msg: KafkaMessage, error: Exception, stage: str) -> None:
+        # Одна битая запись не должна останавливать бэкфилл: без DLQ она только логируется
+        logger.error(f"{msg.topic}[{msg.partition}]@{msg.offset} skipped at {stage}: {error!r}")
+        if dead_letters is not None:
+            dead_letters.send(msg, error, stage)
+
+    consumed = 0
+    rejected = 0
+    idle = 0
+    while not args.max_messages or consumed < args.max_messages:
+        closed = []
+        payloads = []
+        chunk = 0
+        while chunk < args.chunk_size and (not args.max_messages or consumed + chunk < args.max_messages):
+            limit = args.chunk_size - chunk
+            if args.max_messages:
+                limit = min(limit, args.max_messages - consumed - chunk)
+            messages = source.consume_batch(limit, timeout=3.0)
+            if not messages:
+                idle += 1
+                if idle >= args.idle_polls:
+                    break
+                continue
+            idle = 0
+            chunk += len(messages)
+
+            for msg in messages:
+                try:
+                    # Дешёвая проверка по заголовку или сырым байтам, полный разбор - только для кандидатов
+                    if not is_closed_order(msg):
+                        continue
+                    payload = msg.payload()['payload']
+                    if payload['status'] != 'CLOSED':
+                        continue
+                except Exception as e:
+                    reject(msg, e, 'deserialize')
+                    rejected += 1
+                    continue
+                closed.append(msg)
+                payloads.append(payload)
+
+        if chunk == 0:
+            break
+
+        # Строки всего чанка собираются по колонкам и уходят в COPY без построения по одному заказу
+        columns, results = builder.build(payloads)
+        for msg, (error, _) in zip(closed, results):
+            if error is not None:
+                reject(msg, error, 'build')
+                rejected += 1
+        batch = DdsBatch()
+        columns.add_to(batch)
+
+        inserted = loader.load(batch) if len(batch) else {}
+        if dead_letters is not None:
+            dead_letters.flush()
+        # Оффсеты фиксируются после merge и отправки в DLQ, поэтому прерванный бэкфилл продолжается с последнего чанка.
+        source.commit()
+        consumed += chunk
+        logger.info(f"{datetime.utcnow()}: consumed {consumed}, orders in chunk {len(batch)}, inserted {inserted}")
+
+        if idle >= args.idle_polls:
+            break
+
+    source.close()
+    logger.info(f"{datetime.utcnow()}: backfill finished, consumed {consumed}, rejected {rejected}")
+
+
+if __name__ == '__main__':
+    main()
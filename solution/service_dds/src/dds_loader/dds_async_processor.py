@@ -0,0 +1,106 @@
+import asyncio
+from logging import Logger
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg import OperationalError
+
+from lib.kafka_connect import AsyncKafkaProducer, DeadLetterSink, KafkaMessage, RetryPolicy
+from lib.kafka_connect.async_pipeline import Stage
+from lib.metrics import BATCH_SIZE, MESSAGES_FILTERED, MESSAGES_PROCESSED, mark_batch, timed
+from dds_loader.dds_message_processor_job import BuiltOrder, DdsMessageProcessor
+from dds_loader.repository import AsyncDdsRepository, DdsBatch, DdsProcessBuilder
+
+
+class AsyncDdsMessageProcessor(DdsMessageProcessor):
+    """Стадии AsyncPipeline для DDS: сборка, запись в Postgres и отправка в топик CDM.
+
+    Разбор, фильтрация и сборка строк те же, что в DdsMessageProcessor. Оффсетами
+    управляет AsyncPipeline, поэтому консьюмер процессору не нужен.
+    """
+
+    def __init__(self,
+                 producer: AsyncKafkaProducer,
+                 dds_repository: AsyncDdsRepository,
+                 logger: Logger,
+                 validate_payload: bool = False,
+                 dead_letters: Optional[DeadLetterSink] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 process_builder: Optional[DdsProcessBuilder] = None,
+                 columnar_build: bool = False) -> None:
+        super().__init__(
+            consumer=None,
+            producer=producer,
+            dds_repository=dds_repository,
+            logger=logger,
+            validate_payload=validate_payload,
+            dead_letters=dead_letters,
+            retry_policy=retry_policy,
+            process_builder=process_builder,
+            columnar_build=columnar_build
+        )
+
+    def stages(self) -> List[Stage]:
+        return [self.build_stage, self.write_stage, self.produce_stage]
+
+    async def build_stage(self, messages: List[KafkaMessage], _: Any) -> Tuple[DdsBatch, List[BuiltOrder]]:
+        batch = DdsBatch()
+        with timed('deserialize'):
+            orders, filtered = self._closed_payloads(messages)
+        with timed('build'):
+            if self._process_builder is not None:
+                # Ожидание пула процессов не должно блокировать цикл событий
+                built = await asyncio.to_thread(self._build, batch, orders)
+            else:
+                built = self._build(batch, orders)
+
+        self.filtered_total += filtered
+        BATCH_SIZE.observe(len(messages))
+        MESSAGES_FILTERED.inc(filtered)
+        return batch, built
+
+    async def write_stage(self, messages: List[KafkaMessage], state: Tuple[DdsBatch, List[BuiltOrder]]) -> List[Dict[str, Any]]:
+        batch, built = state
+        if not built:
+            return []
+
+        dst_msgs = [dst_msg for _, _, dst_msg in built]
+        try:
+            with timed('db_batch'):
+                await self._dds_repository.insert_batch(batch, dst_msgs)
+            return dst_msgs
+        except OperationalError:
+            # Пачка целиком повторяется конвейером
+            raise
+        except Exception:
+            if self._dead_letters is None:
+                raise
+            self._logger.exception("Batch write failed, writing orders one by one")
+
+        written = []
+        for msg, payload, dst_msg in built:
+            single = DdsBatch()
+            single.add_order(payload)
+            try:
+                await self._retry.call_async(lambda: self._dds_repository.insert_batch(single, [dst_msg]),
+                                             fatal=(OperationalError,))
+            except OperationalError:
+                raise
+            except Exception as e:
+                self._reject(msg, e, 'db')
+                continue
+            written.append(dst_msg)
+        return written
+
+    async def produce_stage(self, messages: List[KafkaMessage], dst_msgs: List[Dict[str, Any]]) -> None:
+        if dst_msgs and not self._dds_repository.writes_outbox:
+            with timed('produce'):
+                for dst_msg in dst_msgs:
+                    self._producer.produce(dst_msg)
+                await self._producer.flush()
+        # flush сохраняет всё отклонённое к этому моменту, в том числе сообщения более поздних пачек
+        if self.last_batch_rejected:
+            self.last_batch_rejected = 0
+            await asyncio.to_thread(self._dead_letters.flush)
+
+        MESSAGES_PROCESSED.inc(len(dst_msgs))
+        mark_batch()
@@ -0,0 +1,52 @@
+from typing import Optional
+
+from lib.kafka_connect import KafkaMessage
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+CLOSED_STATUS = 'CLOSED'
+STATUS_HEADERS = ('status', 'order_status')
+
+
+if msgspec is not None:
+    class _StatusPayload(msgspec.Struct):
+        status: str
+
+    class _StatusEnvelope(msgspec.Struct):
+        payload: _StatusPayload
+
+    _status_decoder = msgspec.json.Decoder(_StatusEnvelope)
+
+
+def _header_status(msg: KafkaMessage) -> Optional[str]:
+    for name, value in msg.headers or ():
+        if name in STATUS_HEADERS and value is not None:
+            return value.decode()
+    return None
+
+
+def is_closed_order(msg: KafkaMessage) -> bool:
+    """Дешёвая проверка статуса заказа без полного разбора сообщения.
+
+    False означает, что заказ точно не CLOSED и сообщение можно пропустить.
+    True - что сообщение нужно разобрать полностью (статус перепроверяется).
+    """
+    status = _header_status(msg)
+    if status is not None:
+        return status == CLOSED_STATUS
+
+    # Если строки CLOSED нет в сообщении, статус не может быть CLOSED
+    if CLOSED_STATUS.encode() not in msg.value:
+        return False
+
+    if msgspec is not None:
+        try:
+            # Разбирается только payload.status, остальные поля пропускаются без материализации
+            return _status_decoder.decode(msg.value).payload.status == CLOSED_STATUS
+        except msgspec.ValidationError:
+            return True
+
+    return True
@@ -1,87 +1,227 @@
 from datetime import datetime
 from logging import Logger
-import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg import OperationalError
+
+from lib.kafka_connect import DeadLetterSink, KafkaMessage, KafkaProducer, MessageSource, RetryPolicy
+from lib.metrics import BATCH_SIZE, MESSAGES_FILTERED, MESSAGES_PROCESSED, mark_batch, timed
+from dds_loader.dds_filter import is_closed_order
+from dds_loader.repository import (KEY_GENERATOR, DdsBatch, DdsColumnarBuilder, DdsProcessBuilder, DdsRepository,
+                                   validate_order_payload)
+
+# Сообщение, его payload и итоговое сообщение для CDM
+Order = Tuple[KafkaMessage, Dict[str, Any]]
+BuiltOrder = Tuple[KafkaMessage, Dict[str, Any], Dict[str, Any]]
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
-from dds_loader.repository import DdsRepository
-from dds_loader.repository import OrderDdsBuilder
 
 class DdsMessageProcessor:
     def __init__(self,
-                 consumer: KafkaConsumer,
+                 consumer: MessageSource,
                  producer: KafkaProducer,
                  dds_repository: DdsRepository,
-                 logger: Logger) -> None:
+                 logger: Logger,
+                 batch_size: int = 30,
+                 commit_every: int = 1,
+                 validate_payload: bool = False,
+                 dead_letters: Optional[DeadLetterSink] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 process_builder: Optional[DdsProcessBuilder] = None,
+                 columnar_build: bool = False) -> None:
         self._consumer = consumer
         self._producer = producer
         self._dds_repository = dds_repository
         self._logger = logger
-        self._batch_size = 30
+        self._batch_size = batch_size
+        self._commit_every = commit_every
+        self._uncommitted_batches = 0
+        self._validate_payload = validate_payload
+        # Без dead_letters ошибка любого сообщения, как и раньше, откатывает всю пачку.
+        # Sink общий для воркеров, но доставку своих сообщений процессор проверяет сам.
+        self._dead_letters = dead_letters.scoped() if dead_letters is not None else None
+        self._retry = retry_policy or RetryPolicy()
+        # Строки собираются в пуле процессов, если он задан
+        self._process_builder = process_builder
+        # Иначе пачка собирается по колонкам сразу для всех заказов
+        self._columnar = DdsColumnarBuilder() if columnar_build else None
+        self.last_batch_rejected = 0
+        # Пропущенные сообщения с промежуточными статусами: их оффсеты фиксируются вместе с пачкой
+        self.filtered_total = 0
+        self.last_batch_filtered = 0
 
-    def run(self) -> None:
-        self._logger.info(f"{datetime.utcnow()}: START")
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    def _reject(self, msg: KafkaMessage, error: Exception, stage: str) -> None:
+        if self._dead_letters is None:
+            raise error
+        self._logger.error(f"{msg.topic}[{msg.partition}]@{msg.offset} sent to dead letters at {stage}: {error!r}")
+        self._dead_letters.send(msg, error, stage)
+        self.last_batch_rejected += 1
+
+    def _closed_payloads(self, messages: List[KafkaMessage]) -> Tuple[List[Order], int]:
+        orders = []
+        filtered = 0
+
+        for msg in messages:
+            try:
+                # Обрабатываем только сообщения со статусом 'CLOSED': сначала дешёвая проверка
+                # по заголовку или сырым байтам, полный разбор - только для кандидатов
+                if not is_closed_order(msg):
+                    filtered += 1
+                    continue
+
+                payload = msg.payload()['payload']
+                if payload['status'] != 'CLOSED':
+                    filtered += 1
+                    continue
 
-        for _ in range(self._batch_size):
-            msg = self._consumer.consume()
-            if not msg:
-                break
+                if self._validate_payload:
+                    validate_order_payload(payload)
+            except Exception as e:
+                # Битое сообщение не станет лучше от повтора
+                self._reject(msg, e, 'deserialize')
+                continue
+            orders.append((msg, payload))
+
+        return orders, filtered
+
+    def _build(self, batch: DdsBatch, orders: List[Order]) -> List[BuiltOrder]:
+        if self._process_builder is not None:
+            return self._build_in_processes(batch, orders)
+        if self._columnar is not None:
+            return self._build_columnar(batch, orders)
+
+        try:
+            # Ключи сущностей пачки считаются по одному разу, дальше builder берёт их из кеша
+            KEY_GENERATOR.prime(payload for _, payload in orders)
+        except Exception:
+            # Заказ, на котором упал prime, будет отклонён ниже при сборке
+            pass
+
+        built = []
+        for msg, payload in orders:
+            try:
+                built.append((msg, payload, batch.add_order(payload)))
+            except Exception as e:
+                self._reject(msg, e, 'build')
+        return built
+
+    def _build_in_processes(self, batch: DdsBatch, orders: List[Order]) -> List[BuiltOrder]:
+        results = self._process_builder.build([payload for _, payload in orders])
+
+        built = []
+        for (msg, payload), (error, rows, dst_msg) in zip(orders, results):
+            if error is not None:
+                self._reject(msg, error, 'build')
+                continue
+            self._process_builder.add_rows(batch, rows)
+            built.append((msg, payload, dst_msg))
+        return built
 
-            payload = msg['payload']
+    def _build_columnar(self, batch: DdsBatch, orders: List[Order]) -> List[BuiltOrder]:
+        columns, results = self._columnar.build([payload for _, payload in orders])
+        columns.add_to(batch)
 
-            # Обрабатываем только сообщения со статусом 'CLOSED'
-            if payload['status'] != 'CLOSED':
+        built = []
+        for (msg, payload), (error, dst_msg) in zip(orders, results):
+            if error is not None:
+                self._reject(msg, error, 'build')
                 continue
+            built.append((msg, payload, dst_msg))
+        return built
+
+    def _write(self, batch: DdsBatch, built: List[BuiltOrder]) -> List[Dict[str, Any]]:
+        # Вся пачка пишется в DdsRepository одной транзакцией: один executemany на таблицу
+        dst_msgs = [dst_msg for _, _, dst_msg in built]
+        try:
+            with timed('db_batch'):
+                self._dds_repository.insert_batch(batch, dst_msgs)
+            return dst_msgs
+        except OperationalError:
+            # Нет соединения с БД: по одному писать бессмысленно, пачка повторяется целиком
+            raise
+        except Exception:
+            if self._dead_letters is None:
+                raise
+            self._logger.exception("Batch write failed, writing orders one by one")
+
+        written = []
+        for msg, payload, dst_msg in built:
+            single = DdsBatch()
+            single.add_order(payload)
+            try:
+                self._retry.call(lambda: self._dds_repository.insert_batch(single, [dst_msg]),
+                                 fatal=(OperationalError,))
+            except OperationalError:
+                raise
+            except Exception as e:
+                self._reject(msg, e, 'db')
+                continue
+            written.append(dst_msg)
+        return written
+
+    def write_batch(self, messages: List[KafkaMessage]) -> int:
+        """Пишет пачку в DDS и отправляет сообщения для CDM, не трогая оффсеты.
+
+        Сообщения, которые не разбираются, не собираются или не пишутся в БД даже
+        по одному после повторов, уходят в dead_letters, остальная пачка проходит.
+        """
+        batch = DdsBatch()
+        self.last_batch_rejected = 0
+
+        with timed('deserialize'):
+            orders, filtered = self._closed_payloads(messages)
+
+        with timed('build'):
+            built = self._build(batch, orders)
+
+        dst_msgs = self._write(batch, built) if built else []
+
+        # Отправка итоговых сообщений в топик: один flush на пачку, до фиксации оффсетов.
+        # В режиме outbox сообщения уже записаны вместе с пачкой, их отправит релей.
+        if dst_msgs and not self._dds_repository.writes_outbox:
+            with timed('produce'):
+                for dst_msg in dst_msgs:
+                    self._producer.produce(dst_msg)
+                self._producer.flush()
+        # Отклонённые сообщения должны быть сохранены до фиксации их оффсетов
+        if self.last_batch_rejected:
+            self._dead_letters.flush()
+
+        self.filtered_total += filtered
+        self.last_batch_filtered = filtered
+        BATCH_SIZE.observe(len(messages))
+        MESSAGES_FILTERED.inc(filtered)
+        MESSAGES_PROCESSED.inc(len(dst_msgs))
+        mark_batch()
+        return len(dst_msgs)
+
+    def process_batch(self, messages: List[KafkaMessage]) -> None:
+        try:
+            orders = self.write_batch(messages)
+
+            # Оффсеты фиксируются только после commit в БД и отправки в топик
+            if messages:
+                self._uncommitted_batches += 1
+            if self._uncommitted_batches >= self._commit_every:
+                self._consumer.commit()
+                self._uncommitted_batches = 0
+        except Exception:
+            self._consumer.rewind()
+            self._uncommitted_batches = 0
+            raise
+
+        self._logger.info(f"{datetime.utcnow()}: consumed: {len(messages)}, orders: {orders}, "
+                          f"filtered: {self.last_batch_filtered}, rejected: {self.last_batch_rejected}, "
+                          f"key cache: {KEY_GENERATOR.stats()}, "
+                          f"satellites: {self._dds_repository.satellite_stats}")
+
+    def run(self) -> None:
+        self._logger.info(f"{datetime.utcnow()}: START")
 
-            load_dt = datetime.now() 
-            load_src = self._consumer.topic
-
-            builder = OrderDdsBuilder(payload)
-            
-            h_user = builder.h_user()
-            h_products = builder.h_product()
-            h_categories = builder.h_category()
-            h_restaurant = builder.h_restaurant()
-            h_order = builder.h_order()
-            
-            l_order_product_links = builder.l_order_product(h_order.h_order_pk, h_products)
-            l_product_restaurant_links = builder.l_product_restaurant(h_products, h_restaurant.h_restaurant_pk)
-            l_product_category_links = builder.l_product_category(h_products, h_categories)
-            l_order_user_link = builder.l_order_user(h_order.h_order_pk, h_user)
-            
-            s_user_names = builder.s_user_names(h_user)
-            s_product_names = builder.s_product_names(h_products)
-            s_restaurant_names = builder.s_restaurant_names(h_restaurant)
-            s_order_cost = builder.s_order_cost(h_order)
-            s_order_status = builder.s_order_status(h_order)
-            
-            # Вставка данных в DdsRepository
-            self._dds_repository.insert_h_user(h_user)
-            self._dds_repository.insert_h_product(h_products)
-            self._dds_repository.insert_h_category(h_categories)
-            self._dds_repository.insert_h_restaurant(h_restaurant)
-            self._dds_repository.insert_h_order(h_order)
-            
-            self._dds_repository.insert_l_order_product(l_order_product_links)
-            self._dds_repository.insert_l_product_restaurant(l_product_restaurant_links)
-            self._dds_repository.insert_l_product_category(l_product_category_links)
-            self._dds_repository.insert_l_order_user(l_order_user_link)
-            
-            self._dds_repository.insert_s_user_names(s_user_names)
-            self._dds_repository.insert_s_product_names(s_product_names)
-            self._dds_repository.insert_s_restaurant_names(s_restaurant_names)
-            self._dds_repository.insert_s_order_cost(s_order_cost)
-            self._dds_repository.insert_s_order_status(s_order_status)
-
-             # Формирование и отправка итогового сообщения в топик
-            dst_msg = {
-                "user_id": h_user.h_user_pk,
-                "product_id": [p.h_product_pk for p in h_products],
-                "product_name": [p.name for p in h_products],
-                "category_id": [c.h_category_pk for c in h_categories],
-                "category_name": [c.category_name for c in h_categories],
-                "order_cnt": [p.quantity for p in h_products]
-            }
-
-            self._producer.produce(dst_msg)
+        messages = self._consumer.consume_batch(self._batch_size, timeout=3.0)
+        self.process_batch(messages)
 
         self._logger.info(f"{datetime.utcnow()}: FINISH")
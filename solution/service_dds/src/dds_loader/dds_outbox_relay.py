@@ -0,0 +1,90 @@
+import threading
+import time
+from logging import Logger
+from typing import Optional
+
+from lib.kafka_connect import KafkaProducer
+from lib.metrics import timed
+from lib.pg import PgConnect
+from dds_loader.repository import DdsOutbox
+
+
+class DdsOutboxRelay:
+    """Отправка сообщений из dds.outbox в топик CDM отдельным потоком.
+
+    Сообщения забираются пачками до batch_size через FOR UPDATE SKIP LOCKED,
+    поэтому релеи нескольких подов не мешают друг другу. Строки помечаются
+    отправленными той же транзакцией только после flush продюсера. Если commit
+    не прошёл после flush, пачка будет отправлена повторно (at-least-once).
+    Отправленные строки старше retention_hours удаляются раз в purge_interval секунд.
+    """
+
+    def __init__(self,
+                 db: PgConnect,
+                 producer: KafkaProducer,
+                 logger: Logger,
+                 batch_size: int = 1000,
+                 poll_interval: float = 1.0,
+                 error_backoff: float = 5.0,
+                 retention_hours: int = 24,
+                 purge_interval: float = 3600.0) -> None:
+        self._db = db
+        self._producer = producer
+        self._logger = logger
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._error_backoff = error_backoff
+        self._retention_hours = retention_hours
+        self._purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='dds-outbox-relay', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def relay_batch(self) -> int:
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                rows = DdsOutbox.claim(cur, self._batch_size)
+                if not rows:
+                    return 0
+
+                with timed('outbox_relay'):
+                    for _, payload in rows:
+                        self._producer.produce_value(payload)
+                    # Ошибка доставки откатывает транзакцию, строки останутся неотправленными
+                    self._producer.flush()
+                DdsOutbox.mark_sent(cur, [row_id for row_id, _ in rows])
+        return len(rows)
+
+    def _purge(self) -> None:
+        if time.monotonic() < self._next_purge:
+            return
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                purged = DdsOutbox.purge(cur, self._retention_hours)
+        self._next_purge = time.monotonic() + self._purge_interval
+        self._logger.info(f"Outbox: purged {purged} sent messages")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                sent = self.relay_batch()
+                self._purge()
+            except Exception:
+                self._logger.exception("Outbox relay failed")
+                self._stop.wait(self._error_backoff)
+                continue
+
+            # Неполная пачка - outbox разобран, ждём новых сообщений
+            if sent < self._batch_size:
+                self._stop.wait(self._poll_interval)
+
+        self._logger.info("Outbox relay stopped")
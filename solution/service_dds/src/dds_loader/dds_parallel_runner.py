@@ -0,0 +1,286 @@
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from logging import Logger
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from lib.kafka_connect import AdaptiveBatchSizer, KafkaConsumer, KafkaMessage, OffsetTracker
+from dds_loader.dds_message_processor_job import DdsMessageProcessor
+
+
+class DdsParallelRunner:
+    """Параллельная обработка DDS пулом потоков-воркеров.
+
+    Сообщения распределяются по воркерам по номеру партиции (shard_by='partition')
+    или по хешу ключа сообщения (shard_by='key'), поэтому сообщения одной партиции
+    или одного заказа всегда обрабатываются одним воркером по порядку. У каждого
+    воркера свой DdsMessageProcessor, соединения он берёт из общего пула. Оффсеты
+    фиксирует поток чтения через OffsetTracker - только непрерывно обработанные.
+    Если необработанных сообщений больше max_in_flight или очередь воркера заполнена,
+    чтение ставится на паузу. Пачка, не записанная за max_retries попыток, бросается,
+    а её партиции возвращаются к зафиксированным оффсетам и читаются заново. Каждое
+    розданное сообщение помечается поколением своей партиции; после возврата партиции
+    сообщения старых поколений пропускаются без записи и без отметки в OffsetTracker.
+    """
+
+    def __init__(self,
+                 consumer: KafkaConsumer,
+                 processor_factory: Callable[[], DdsMessageProcessor],
+                 logger: Logger,
+                 workers: int = 4,
+                 shard_by: str = 'partition',
+                 batch_size: int = 30,
+                 queue_size: int = 1000,
+                 poll_timeout: float = 1.0,
+                 error_backoff: float = 5.0,
+                 sizer_factory: Optional[Callable[[], AdaptiveBatchSizer]] = None,
+                 max_in_flight: int = 5000,
+                 max_retries: int = 3,
+                 drain_timeout: float = 60.0) -> None:
+        self._consumer = consumer
+        self._logger = logger
+        self._shard_by = shard_by
+        self._batch_size = batch_size
+        self._poll_timeout = poll_timeout
+        self._error_backoff = error_backoff
+        # Очереди воркеров вмещают не больше workers * queue_size сообщений: порог выше этого
+        # не сработал бы, сообщения копились бы в backlog потока чтения
+        self._max_in_flight = min(max_in_flight, workers * queue_size)
+        self._max_retries = max_retries
+        self._drain_timeout = drain_timeout
+        self._paused = False
+
+        self._tracker = OffsetTracker()
+        self._processors = [processor_factory() for _ in range(workers)]
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._sizers = [sizer_factory() if sizer_factory else None for _ in range(workers)]
+        # Сообщения, не поместившиеся в заполненную очередь воркера, ждут в потоке чтения
+        self._backlog: List[Deque[Tuple[int, KafkaMessage]]] = [deque() for _ in range(workers)]
+        # Поколения партиций и партиции брошенных воркерами пачек, которые поток чтения
+        # должен вернуть к зафиксированным оффсетам. До возврата их сообщения пропускаются.
+        self._lock = threading.Lock()
+        self._generations: Dict[Tuple[str, int], int] = {}
+        self._rewinds: Set[Tuple[str, int]] = set()
+
+        self._stop = threading.Event()
+        self._workers_stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._workers: List[threading.Thread] = []
+
+    def start(self) -> None:
+        self._consumer.set_rebalance_callbacks(on_assign=self._on_assign, on_revoke=self._on_revoke)
+        for index in range(len(self._queues)):
+            worker = threading.Thread(target=self._work, args=(index,), name=f'dds-worker-{index}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        self._thread = threading.Thread(target=self._run, name='dds-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _shard(self, msg: KafkaMessage) -> int:
+        if self._shard_by == 'key' and msg.key:
+            return zlib.crc32(msg.key) % len(self._queues)
+        return msg.partition % len(self._queues)
+
+    def _next_batch(self, q: queue.Queue, batch_size: int) -> List[Tuple[int, KafkaMessage]]:
+        try:
+            messages = [q.get(timeout=self._poll_timeout)]
+        except queue.Empty:
+            return []
+        while len(messages) < batch_size:
+            try:
+                messages.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return messages
+
+    def _work(self, index: int) -> None:
+        q = self._queues[index]
+        processor = self._processors[index]
+        sizer = self._sizers[index]
+
+        while not self._workers_stop.is_set():
+            items = self._next_batch(q, sizer.size if sizer is not None else self._batch_size)
+            if not items:
+                continue
+
+            # Сообщения возвращённых партиций будут прочитаны заново, писать их сейчас - нарушить порядок
+            with self._lock:
+                live = [(generation, msg) for generation, msg in items if self._is_current(generation, msg)]
+            messages = [msg for _, msg in live]
+            if not messages:
+                for _ in items:
+                    q.task_done()
+                continue
+
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    processor.write_batch(messages)
+                except Exception:
+                    attempt += 1
+                    self._logger.exception(f"Worker {index}: batch failed, attempt {attempt}")
+                    if sizer is not None:
+                        sizer.record(len(messages), float('inf'))
+                    if attempt >= self._max_retries:
+                        # Бросаем пачку: оффсеты не отмечены, поток чтения перечитает её партиции
+                        self._logger.error(f"Worker {index}: giving up on {len(messages)} messages, rewinding")
+                        with self._lock:
+                            self._rewinds.update((msg.topic, msg.partition) for msg in messages)
+                        break
+                    # При остановке сдаёмся: оффсеты не зафиксированы, пачка будет прочитана заново
+                    if self._stop.wait(self._error_backoff):
+                        break
+                    continue
+
+                if sizer is not None:
+                    sizer.record(len(messages), time.monotonic() - started)
+                # Под блокировкой: возврат партиции не вклинится между проверкой поколения и done
+                with self._lock:
+                    for generation, msg in live:
+                        if self._is_current(generation, msg):
+                            self._tracker.done(msg.topic, msg.partition, msg.offset)
+                break
+
+            for _ in items:
+                q.task_done()
+
+    def _is_current(self, generation: int, msg: KafkaMessage) -> bool:
+        # Вызывается под self._lock
+        key = (msg.topic, msg.partition)
+        return key not in self._rewinds and self._generations.get(key, 0) == generation
+
+    def _commit(self) -> None:
+        offsets = self._tracker.pop_committable()
+        try:
+            self._consumer.commit_offsets(offsets)
+        except Exception:
+            self._logger.exception("Offset commit failed")
+
+    def _drain(self) -> bool:
+        # Ждём разбора очередей не дольше drain_timeout, чтобы не выпасть из группы по max.poll.interval.ms
+        deadline = time.monotonic() + self._drain_timeout
+        drained = True
+        for q in self._queues:
+            with q.all_tasks_done:
+                while q.unfinished_tasks:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        drained = False
+                        break
+                    q.all_tasks_done.wait(remaining)
+        if not drained:
+            self._logger.warning("Workers did not drain in time, unfinished messages will be read again")
+        self._commit()
+        return drained
+
+    def _dispatch(self, generation: int, msg: KafkaMessage) -> None:
+        # Поток чтения не блокируется на заполненной очереди: сообщение ждёт в backlog шарда,
+        # а следующие сообщения шарда встают за ним, чтобы не нарушить порядок.
+        shard = self._shard(msg)
+        backlog = self._backlog[shard]
+        if not backlog:
+            try:
+                self._queues[shard].put_nowait((generation, msg))
+                return
+            except queue.Full:
+                pass
+        backlog.append((generation, msg))
+
+    def _flush_backlog(self) -> None:
+        for q, backlog in zip(self._queues, self._backlog):
+            while backlog:
+                try:
+                    q.put_nowait(backlog[0])
+                except queue.Full:
+                    break
+                backlog.popleft()
+
+    def _drop(self, partitions: Set[Tuple[str, int]]) -> None:
+        # Сообщения этих партиций в backlog ещё не розданы и будут прочитаны заново,
+        # а уже розданные воркерам устаревают вместе с поколением партиции
+        for index, backlog in enumerate(self._backlog):
+            self._backlog[index] = deque((generation, msg) for generation, msg in backlog
+                                         if (msg.topic, msg.partition) not in partitions)
+        with self._lock:
+            for key in partitions:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._rewinds -= partitions
+            self._tracker.forget(partitions)
+
+    def _apply_rewinds(self) -> None:
+        with self._lock:
+            partitions = set(self._rewinds)
+        if not partitions:
+            return
+        try:
+            self._consumer.rewind(partitions)
+        except Exception:
+            # Партиции остаются в _rewinds, повторим на следующей итерации
+            self._logger.exception("Rewind failed")
+            return
+        self._drop(partitions)
+        self._logger.info(f"Rewound partitions {sorted(p for _, p in partitions)}")
+
+    def _apply_backpressure(self) -> None:
+        # Запись не успевает за чтением: ставим партиции на паузу, но продолжаем poll,
+        # чтобы под оставался в группе. Снимаем паузу, когда очередь разобрана наполовину.
+        in_flight = self._tracker.in_flight()
+        backlog = any(self._backlog)
+        if not self._paused and (backlog or in_flight >= self._max_in_flight):
+            self._consumer.pause()
+            self._paused = True
+            self._logger.info(f"Paused consumption, in flight: {in_flight}")
+        elif self._paused and not backlog and in_flight <= self._max_in_flight // 2:
+            self._consumer.resume()
+            self._paused = False
+            self._logger.info(f"Resumed consumption, in flight: {in_flight}")
+
+    def _on_assign(self, consumer, partitions) -> None:
+        # Новое назначение приходит без паузы, при необходимости _apply_backpressure поставит её снова
+        self._paused = False
+
+    def _on_revoke(self, consumer, partitions) -> None:
+        # Дорабатываем уже розданные сообщения и фиксируем их до передачи партиций другому поду.
+        # Не розданные из backlog новый владелец прочитает сам.
+        self._drain()
+        self._drop({(tp.topic, tp.partition) for tp in partitions})
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._apply_rewinds()
+            self._flush_backlog()
+            try:
+                messages = self._consumer.consume_batch(self._batch_size * len(self._queues), self._poll_timeout)
+            except Exception:
+                self._logger.exception("Kafka poll failed")
+                self._stop.wait(self._error_backoff)
+                continue
+
+            for msg in messages:
+                key = (msg.topic, msg.partition)
+                with self._lock:
+                    if key in self._rewinds:
+                        # Партиция ждёт возврата, сообщение будет прочитано заново
+                        continue
+                    generation = self._generations.get(key, 0)
+                self._tracker.track(msg.topic, msg.partition, msg.offset)
+                self._dispatch(generation, msg)
+
+            self._commit()
+            self._apply_backpressure()
+
+        self._drain()
+        self._workers_stop.set()
+        for worker in self._workers:
+            worker.join()
+        self._consumer.close()
+        self._logger.info("Parallel DDS runner stopped")
@@ -1,2 +1,10 @@
-from .dds_repository import DdsRepository  # noqa
-from .dds_builder import OrderDdsBuilder
\ No newline at end of file
+from .dds_repository import DdsKnownKeys, DdsRepository, DdsSatelliteCache  # noqa
+from .dds_outbox import DdsOutbox  # noqa
+from .dds_repository_async import AsyncDdsRepository  # noqa
+from .dds_builder import OrderDdsBuilder  # noqa
+from .dds_batch import DdsBatch  # noqa
+from .dds_bulk_loader import DdsBulkLoader  # noqa
+from .dds_keys import KEY_GENERATOR, DdsKeyGenerator  # noqa
+from .dds_validation import validate_order_payload  # noqa
+from .dds_process_builder import DdsProcessBuilder  # noqa
+from .dds_columnar import DdsColumnarBuilder, DdsColumns  # noqa
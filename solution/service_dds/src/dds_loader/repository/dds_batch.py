@@ -0,0 +1,85 @@
+from typing import Any, Dict, List
+
+from .dds_builder import OrderDdsBuilder
+from .dds_models import (H_User, H_Product, H_Category, H_Restaurant, H_Order, L_Order_Product,
+                         L_Product_Restaurant, L_Product_Category, L_Order_User, S_User_Names, S_Product_Names,
+                         S_Restaurant_Names, S_Order_Cost, S_Order_Status
+                         )
+
+
+TABLES = ('h_user', 'h_product', 'h_category', 'h_restaurant', 'h_order',
+          'l_order_product', 'l_product_restaurant', 'l_product_category', 'l_order_user',
+          's_user_names', 's_product_names', 's_restaurant_names', 's_order_cost', 's_order_status')
+
+
+class DdsBatch:
+    """Строки хабов, линков и сателлитов, накопленные за одну пачку сообщений."""
+
+    def __init__(self) -> None:
+        self.h_user: List[H_User] = []
+        self.h_product: List[H_Product] = []
+        self.h_category: List[H_Category] = []
+        self.h_restaurant: List[H_Restaurant] = []
+        self.h_order: List[H_Order] = []
+
+        self.l_order_product: List[L_Order_Product] = []
+        self.l_product_restaurant: List[L_Product_Restaurant] = []
+        self.l_product_category: List[L_Product_Category] = []
+        self.l_order_user: List[L_Order_User] = []
+
+        self.s_user_names: List[S_User_Names] = []
+        self.s_product_names: List[S_Product_Names] = []
+        self.s_restaurant_names: List[S_Restaurant_Names] = []
+        self.s_order_cost: List[S_Order_Cost] = []
+        self.s_order_status: List[S_Order_Status] = []
+
+    def __len__(self) -> int:
+        return len(self.h_order)
+
+    def add_order(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Добавляет строки заказа целиком или, если заказ не собрался, не добавляет ничего."""
+        sizes = [len(getattr(self, table)) for table in TABLES]
+        try:
+            return self._add_order(payload)
+        except Exception:
+            for table, size in zip(TABLES, sizes):
+                del getattr(self, table)[size:]
+            raise
+
+    def _add_order(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        builder = OrderDdsBuilder(payload)
+
+        h_user = builder.h_user()
+        h_products = builder.h_product()
+        h_categories = builder.h_category()
+        h_restaurant = builder.h_restaurant()
+        h_order = builder.h_order()
+
+        self.h_user.append(h_user)
+        self.h_product.extend(h_products)
+        self.h_category.extend(h_categories)
+        self.h_restaurant.append(h_restaurant)
+        self.h_order.append(h_order)
+
+        self.l_order_product.extend(builder.l_order_product(h_order.h_order_pk, h_products))
+        self.l_product_restaurant.extend(builder.l_product_restaurant(h_products, h_restaurant.h_restaurant_pk))
+        self.l_product_category.extend(builder.l_product_category(h_products, h_categories))
+        self.l_order_user.append(builder.l_order_user(h_order.h_order_pk, h_user))
+
+        self.s_user_names.append(builder.s_user_names(h_user))
+        self.s_product_names.extend(builder.s_product_names(h_products))
+        self.s_restaurant_names.append(builder.s_restaurant_names(h_restaurant))
+        self.s_order_cost.append(builder.s_order_cost(h_order))
+        self.s_order_status.append(builder.s_order_status(h_order))
+
+        # Формирование итогового сообщения для топика
+        # order_id - ключ заказа, по нему CDM не применяет повторно доставленный заказ
+        return {
+            "order_id": h_order.h_order_pk,
+            "user_id": h_user.h_user_pk,
+            "product_id": [p.h_product_pk for p in h_products],
+            "product_name": [p['name'] for p in payload['products']],
+            "category_id": [c.h_category_pk for c in h_categories],
+            "category_name": [c.category_name for c in h_categories],
+            "order_cnt": [p['quantity'] for p in payload['products']]
+        }
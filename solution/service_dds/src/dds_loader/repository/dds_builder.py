@@ -1,18 +1,26 @@
+import uuid
 from typing import List
 from datetime import datetime
-from dds_models import (H_User, H_Product, H_Category, H_Restaurant, H_Order,  L_Order_Product,
-                        L_Product_Restaurant, L_Product_Restaurant, L_Order_User, S_User_Names, S_Product_Names,
-                        S_Restaurant_Names, S_Order_Cost, S_Order_Status
-                        )
+from .dds_models import (H_User, H_Product, H_Category, H_Restaurant, H_Order,  L_Order_Product,
+                         L_Product_Restaurant, L_Product_Category, L_Order_User, S_User_Names, S_Product_Names,
+                         S_Restaurant_Names, S_Order_Cost, S_Order_Status
+                         )
+from .dds_keys import KEY_GENERATOR, DdsKeyGenerator
 
 
 class OrderDdsBuilder:
-    def __init__(self, data: dict) -> None:
+    def __init__(self, data: dict, keys: DdsKeyGenerator = KEY_GENERATOR) -> None:
         self._data = data
         self.source_system = ""
-        self.order_ns_uuid = uuid.UUID('12345678-1234-5678-1234-567812345678')
-    def _uuid(self, obj: any) -> uuid.UUID:
-        return uuid.uuid5(namespace=self.order_ns_uuid, name=str(obj))
+        self._keys = keys
+        self.order_ns_uuid = keys.namespace
+
+    def _uuid(self, *parts: any) -> uuid.UUID:
+        return self._keys.key(*parts)
+
+    def _order_uuid(self, *parts: any) -> uuid.UUID:
+        # Ключи, уникальные для заказа, не кешируем
+        return self._keys.key_uncached(*parts)
 
     def h_user(self) -> H_User:
         user_id = self._data['user']['id']
@@ -63,7 +71,7 @@ class OrderDdsBuilder:
     def h_order(self) -> H_Order:
         order_id = self._data['order']['id']
         return H_Order(
-            h_order_pk=self._uuid(order_id),
+            h_order_pk=self._order_uuid(order_id),
             order_id=order_id,
             order_dt=self._data['order']['date'],
             load_dt=datetime.utcnow(),
@@ -75,7 +83,7 @@ class OrderDdsBuilder:
         for product in products:
             links.append(
                 L_Order_Product(
-                    hk_order_product_pk=self._uuid(f"{h_order_pk}{product.h_product_pk}"),
+                    hk_order_product_pk=self._order_uuid(h_order_pk, product.h_product_pk),
                     h_order_pk=h_order_pk,
                     h_product_pk=product.h_product_pk,
                     load_dt=datetime.utcnow(),
@@ -89,7 +97,7 @@ class OrderDdsBuilder:
         for product in products:
             links.append(
                 L_Product_Restaurant(
-                    hk_product_restaurant_pk=self._uuid(f"{product.h_product_pk}{h_restaurant_pk}"),
+                    hk_product_restaurant_pk=self._uuid(product.h_product_pk, h_restaurant_pk),
                     h_product_pk=product.h_product_pk,
                     h_restaurant_pk=h_restaurant_pk,
                     load_dt=datetime.utcnow(),
@@ -104,7 +112,7 @@ class OrderDdsBuilder:
             for category in categories:
                 links.append(
                     L_Product_Category(
-                        hk_product_category_pk=self._uuid(f"{product.h_product_pk}{category.h_category_pk}"),
+                        hk_product_category_pk=self._uuid(product.h_product_pk, category.h_category_pk),
                         h_product_pk=product.h_product_pk,
                         h_category_pk=category.h_category_pk,
                         load_dt=datetime.utcnow(),
@@ -115,7 +123,7 @@ class OrderDdsBuilder:
 
     def l_order_user(self, h_order_pk: uuid.UUID, user: H_User) -> L_Order_User:
         return L_Order_User(
-            hk_order_user_pk=self._uuid(f"{h_order_pk}{user.h_user_pk}"),
+            hk_order_user_pk=self._order_uuid(h_order_pk, user.h_user_pk),
             h_order_pk=h_order_pk,
             h_user_pk=user.h_user_pk,
             load_dt=datetime.utcnow(),
@@ -129,7 +137,7 @@ class OrderDdsBuilder:
             userlogin=self._data['user']['login'],
             load_dt=datetime.utcnow(),
             load_src=self.source_system,
-            hk_user_names_hashdiff=self._uuid(f"{user.h_user_pk}{self._data['user']['name']}{self._data['user']['login']}")
+            hk_user_names_hashdiff=self._uuid(user.h_user_pk, self._data['user']['name'], self._data['user']['login'])
         )
 
     def s_product_names(self, products: List[H_Product]) -> List[S_Product_Names]:
@@ -141,7 +149,7 @@ class OrderDdsBuilder:
                     name=product.product_id,
                     load_dt=datetime.utcnow(),
                     load_src=self.source_system,
-                    hk_product_names_hashdiff=self._uuid(f"{product.h_product_pk}{product.product_id}")
+                    hk_product_names_hashdiff=self._uuid(product.h_product_pk, product.product_id)
                 )
             )
         return names
@@ -152,7 +160,7 @@ class OrderDdsBuilder:
             name=self._data['restaurant']['name'],
             load_dt=datetime.utcnow(),
             load_src=self.source_system,
-            hk_restaurant_names_hashdiff=self._uuid(f"{restaurant.h_restaurant_pk}{self._data['restaurant']['name']}")
+            hk_restaurant_names_hashdiff=self._uuid(restaurant.h_restaurant_pk, self._data['restaurant']['name'])
         )
 
     def s_order_cost(self, order: H_Order) -> S_Order_Cost:
@@ -162,7 +170,7 @@ class OrderDdsBuilder:
             payment=self._data['order']['payment'],
             load_dt=datetime.utcnow(),
             load_src=self.source_system,
-            hk_order_cost_hashdiff=self._uuid(f"{order.h_order_pk}{self._data['order']['cost']}{self._data['order']['payment']}")
+            hk_order_cost_hashdiff=self._order_uuid(order.h_order_pk, self._data['order']['cost'], self._data['order']['payment'])
         )
 
     def s_order_status(self, order: H_Order) -> S_Order_Status:
@@ -171,5 +179,5 @@ class OrderDdsBuilder:
             status=self._data['status'],
             load_dt=datetime.utcnow(),
             load_src=self.source_system,
-            hk_order_status_hashdiff=self._uuid(f"{order.h_order_pk}{self._data['status']}")
+            hk_order_status_hashdiff=self._order_uuid(order.h_order_pk, self._data['status'])
         )
@@ -0,0 +1,89 @@
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+from psycopg import Cursor
+
+from lib.pg import PgConnect
+from .dds_batch import DdsBatch
+from .dds_repository import DdsRepository, TABLE_COLUMNS, TABLE_KEYS, TABLE_QUERIES
+
+UUID_OID = 2950
+NUMERIC_OID = 1700
+TIMESTAMP_OID = 1114
+TIMESTAMPTZ_OID = 1184
+
+
+class DdsBulkLoader:
+    """Загрузка пачки в dds.* через COPY во временные таблицы и set-based merge.
+
+    Предназначен для бэкфиллов: каждая таблица пачки копируется во временную
+    таблицу в бинарном формате, затем переносится одним
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    """
+
+    def __init__(self, db: PgConnect) -> None:
+        self._db = db
+        self._column_types: Dict[str, Dict[str, int]] = {}
+
+    def _load_column_types(self, cur: Cursor, table: str) -> Dict[str, int]:
+        if table not in self._column_types:
+            cur.execute(
+                """
+                    SELECT attname, atttypid
+                    FROM pg_attribute
+                    WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;
+                """,
+                (f"dds.{table}",)
+            )
+            self._column_types[table] = {name: oid for name, oid in cur.fetchall()}
+        return self._column_types[table]
+
+    @staticmethod
+    def _copy_row(row: Tuple[Any, ...], types: List[int]) -> Tuple[Any, ...]:
+        values = []
+        for value, oid in zip(row, types):
+            # Бинарный COPY выбирает дампер по типу колонки, а не по типу значения.
+            if isinstance(value, uuid.UUID) and oid != UUID_OID:
+                value = str(value)
+            elif isinstance(value, float) and oid == NUMERIC_OID:
+                value = Decimal(str(value))
+            elif isinstance(value, str) and oid in (TIMESTAMP_OID, TIMESTAMPTZ_OID):
+                value = datetime.fromisoformat(value)
+            values.append(value)
+        return tuple(values)
+
+    def _merge_table(self, cur: Cursor, table: str, rows: List[Tuple[Any, ...]]) -> int:
+        rows = DdsRepository.unique_rows(table, rows)
+        if not rows:
+            return 0
+
+        columns = TABLE_COLUMNS[table]
+        column_types = self._load_column_types(cur, table)
+        types = [column_types[column] for column in columns]
+        column_list = ", ".join(columns)
+        stage = f"stage_{table}"
+
+        cur.execute(f"CREATE TEMP TABLE {stage} (LIKE dds.{table}) ON COMMIT DROP;")
+        with cur.copy(f"COPY {stage} ({column_list}) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(types)
+            for row in rows:
+                copy.write_row(self._copy_row(row, types))
+
+        cur.execute(
+            f"""
+                INSERT INTO dds.{table} ({column_list})
+                SELECT {column_list} FROM {stage}
+                ON CONFLICT ({TABLE_KEYS[table]}) DO NOTHING;
+            """
+        )
+        return cur.rowcount
+
+    def load(self, batch: DdsBatch) -> Dict[str, int]:
+        inserted = {}
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                for table in TABLE_QUERIES:
+                    inserted[table] = self._merge_table(cur, table, getattr(batch, table))
+        return inserted
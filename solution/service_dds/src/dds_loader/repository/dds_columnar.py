@@ -0,0 +1,210 @@
+import uuid
+from datetime import datetime
+from itertools import repeat
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .dds_batch import TABLES, DdsBatch
+from .dds_keys import KEY_GENERATOR, DdsKeyGenerator
+
+# Результат разбора заказа: ошибка либо итоговое сообщение для CDM
+ColumnarOrder = Tuple[Optional[Exception], Optional[Dict[str, Any]]]
+
+
+class _Order:
+    """Поля одного заказа, нужные для строк DDS, извлечённые до построения колонок."""
+
+    __slots__ = ('user_id', 'user_name', 'user_login', 'restaurant_id', 'restaurant_name', 'order_id',
+                 'order_dt', 'cost', 'payment', 'status', 'product_ids', 'product_names', 'quantities',
+                 'category_names')
+
+    def __init__(self, payload: Dict[str, Any]) -> None:
+        user = payload['user']
+        restaurant = payload['restaurant']
+        order = payload['order']
+        self.user_id = user['id']
+        self.user_name = user['name']
+        self.user_login = user['login']
+        self.restaurant_id = restaurant['id']
+        self.restaurant_name = restaurant['name']
+        self.order_id = order['id']
+        self.order_dt = order['date']
+        self.cost = order['cost']
+        self.payment = order['payment']
+        self.status = payload['status']
+        products = payload['products']
+        self.product_ids = [p['id'] for p in products]
+        self.product_names = [p['name'] for p in products]
+        self.quantities = [p['quantity'] for p in products]
+        self.category_names = [c['name'] for c in payload['categories']]
+        # Нехешируемый id должен отклонить этот заказ здесь, а не сломать сборку всей пачки
+        hash((self.user_id, self.user_name, self.user_login, self.restaurant_id, self.restaurant_name, self.order_id,
+              self.cost, self.payment, self.status, *self.product_ids, *self.category_names))
+
+
+class DdsColumns:
+    """Строки пачки по таблицам в виде колонок в порядке TABLE_COLUMNS.
+
+    load_dt и load_src одинаковы для всей пачки и хранятся одним значением.
+    rows() склеивает колонки в кортежи на лету, результат можно сразу
+    передавать в executemany или COPY без промежуточных объектов строк.
+    """
+
+    def __init__(self, load_dt: datetime, load_src: str = "") -> None:
+        self.load_dt = load_dt
+        self.load_src = load_src
+        self.h_user: Tuple[List[Any], ...] = ([], [])
+        self.h_product: Tuple[List[Any], ...] = ([], [])
+        self.h_category: Tuple[List[Any], ...] = ([], [])
+        self.h_restaurant: Tuple[List[Any], ...] = ([], [])
+        self.h_order: Tuple[List[Any], ...] = ([], [], [])
+
+        self.l_order_product: Tuple[List[Any], ...] = ([], [], [])
+        self.l_product_restaurant: Tuple[List[Any], ...] = ([], [], [])
+        self.l_product_category: Tuple[List[Any], ...] = ([], [], [])
+        self.l_order_user: Tuple[List[Any], ...] = ([], [], [])
+
+        self.s_user_names: Tuple[List[Any], ...] = ([], [], [], [])
+        self.s_product_names: Tuple[List[Any], ...] = ([], [], [])
+        self.s_restaurant_names: Tuple[List[Any], ...] = ([], [], [])
+        self.s_order_cost: Tuple[List[Any], ...] = ([], [], [], [])
+        self.s_order_status: Tuple[List[Any], ...] = ([], [], [])
+
+    def __len__(self) -> int:
+        return len(self.h_order[0])
+
+    def rows(self, table: str) -> Iterator[Tuple[Any, ...]]:
+        columns = getattr(self, table)
+        load_dt = repeat(self.load_dt)
+        load_src = repeat(self.load_src)
+        if table.startswith('s_'):
+            # В сателлитах load_dt и load_src стоят перед hashdiff
+            return zip(*columns[:-1], load_dt, load_src, columns[-1])
+        return zip(*columns, load_dt, load_src)
+
+    def add_to(self, batch: DdsBatch) -> None:
+        for table in TABLES:
+            getattr(batch, table).extend(self.rows(table))
+
+
+class DdsColumnarBuilder:
+    """Сборка строк DDS сразу для всей пачки заказов, по колонкам.
+
+    Ключи хабов и линков между повторяющимися сущностями считаются один раз
+    на различное значение в пачке, load_dt один на пачку. Строки получаются
+    те же, что у OrderDdsBuilder, кроме load_dt.
+    """
+
+    def __init__(self, keys: DdsKeyGenerator = KEY_GENERATOR, load_src: str = "") -> None:
+        self._keys = keys
+        self._load_src = load_src
+
+    def build(self, payloads: Sequence[Dict[str, Any]]) -> Tuple[DdsColumns, List[ColumnarOrder]]:
+        columns = DdsColumns(datetime.utcnow(), self._load_src)
+        results: List[ColumnarOrder] = []
+
+        orders = []
+        for payload in payloads:
+            try:
+                orders.append(_Order(payload))
+            except Exception as e:
+                results.append((e, None))
+                continue
+            results.append((None, None))
+
+        keys: Dict[str, uuid.UUID] = {}
+        name = self._keys.name
+
+        def key(*parts: Any) -> uuid.UUID:
+            # По строке, как и в DdsKeyGenerator: равные кортежи (1,) и (True,) дают разные ключи
+            parts_name = name(*parts)
+            value = keys.get(parts_name)
+            if value is None:
+                value = keys[parts_name] = self._keys.key(*parts)
+            return value
+
+        key_uncached = self._keys.key_uncached
+
+        dst_msgs = []
+        for order in orders:
+            h_user_pk = key(order.user_id)
+            h_restaurant_pk = key(order.restaurant_id)
+            h_order_pk = key_uncached(order.order_id)
+            h_product_pks = [key(product_id) for product_id in order.product_ids]
+            h_category_pks = [key(name) for name in order.category_names]
+
+            columns.h_user[0].append(h_user_pk)
+            columns.h_user[1].append(order.user_id)
+            columns.h_product[0].extend(h_product_pks)
+            columns.h_product[1].extend(order.product_ids)
+            columns.h_category[0].extend(h_category_pks)
+            columns.h_category[1].extend(order.category_names)
+            columns.h_restaurant[0].append(h_restaurant_pk)
+            columns.h_restaurant[1].append(order.restaurant_id)
+            columns.h_order[0].append(h_order_pk)
+            columns.h_order[1].append(order.order_id)
+            columns.h_order[2].append(order.order_dt)
+
+            products = len(h_product_pks)
+            categories = len(h_category_pks)
+
+            l_order_product = columns.l_order_product
+            l_order_product[0].extend(key_uncached(h_order_pk, pk) for pk in h_product_pks)
+            l_order_product[1].extend(repeat(h_order_pk, products))
+            l_order_product[2].extend(h_product_pks)
+
+            l_product_restaurant = columns.l_product_restaurant
+            l_product_restaurant[0].extend(key(pk, h_restaurant_pk) for pk in h_product_pks)
+            l_product_restaurant[1].extend(h_product_pks)
+            l_product_restaurant[2].extend(repeat(h_restaurant_pk, products))
+
+            l_product_category = columns.l_product_category
+            for h_product_pk in h_product_pks:
+                l_product_category[0].extend(key(h_product_pk, pk) for pk in h_category_pks)
+                l_product_category[1].extend(repeat(h_product_pk, categories))
+                l_product_category[2].extend(h_category_pks)
+
+            columns.l_order_user[0].append(key_uncached(h_order_pk, h_user_pk))
+            columns.l_order_user[1].append(h_order_pk)
+            columns.l_order_user[2].append(h_user_pk)
+
+            s_user_names = columns.s_user_names
+            s_user_names[0].append(h_user_pk)
+            s_user_names[1].append(order.user_name)
+            s_user_names[2].append(order.user_login)
+            s_user_names[3].append(key(h_user_pk, order.user_name, order.user_login))
+
+            s_product_names = columns.s_product_names
+            s_product_names[0].extend(h_product_pks)
+            s_product_names[1].extend(order.product_ids)
+            s_product_names[2].extend(key(pk, product_id) for pk, product_id in zip(h_product_pks, order.product_ids))
+
+            s_restaurant_names = columns.s_restaurant_names
+            s_restaurant_names[0].append(h_restaurant_pk)
+            s_restaurant_names[1].append(order.restaurant_name)
+            s_restaurant_names[2].append(key(h_restaurant_pk, order.restaurant_name))
+
+            s_order_cost = columns.s_order_cost
+            s_order_cost[0].append(h_order_pk)
+            s_order_cost[1].append(order.cost)
+            s_order_cost[2].append(order.payment)
+            s_order_cost[3].append(key_uncached(h_order_pk, order.cost, order.payment))
+
+            s_order_status = columns.s_order_status
+            s_order_status[0].append(h_order_pk)
+            s_order_status[1].append(order.status)
+            s_order_status[2].append(key_uncached(h_order_pk, order.status))
+
+            dst_msgs.append({
+                "order_id": h_order_pk,
+                "user_id": h_user_pk,
+                "product_id": h_product_pks,
+                "product_name": order.product_names,
+                "category_id": h_category_pks,
+                "category_name": order.category_names,
+                "order_cnt": order.quantities
+            })
+
+        # Сообщения для CDM в порядке исходных заказов
+        dst = iter(dst_msgs)
+        results = [(error, None if error is not None else next(dst)) for error, _ in results]
+        return columns, results
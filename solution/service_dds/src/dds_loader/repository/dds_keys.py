@@ -0,0 +1,58 @@
+import uuid
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .dds_cache import LruCache
+
+ORDER_NS_UUID = uuid.UUID('12345678-1234-5678-1234-567812345678')
+
+
+class DdsKeyGenerator:
+    """Детерминированные ключи хабов, линков и hashdiff с LRU-кешем.
+
+    Ключ - uuid5 от конкатенации строковых представлений частей, то есть
+    key(a, b) == uuid5(ns, f"{a}{b}"). Кешируются ключи повторяющихся
+    сущностей (пользователи, товары, рестораны, категории); ключи, уникальные
+    для заказа, считаются через key_uncached и кеш не вытесняют.
+    """
+
+    def __init__(self, max_size: int = 100_000, namespace: uuid.UUID = ORDER_NS_UUID) -> None:
+        self.namespace = namespace
+        self.cache = LruCache(max_size)
+
+    @staticmethod
+    def name(*parts: Any) -> str:
+        # Кешировать нужно по этой строке, а не по кортежу частей: (1,), (1.0,) и (True,)
+        # равны как ключи словаря, но дают разные строки и разные UUID
+        return "".join(str(p) for p in parts)
+
+    def key_uncached(self, *parts: Any) -> uuid.UUID:
+        return uuid.uuid5(self.namespace, self.name(*parts))
+
+    def key(self, *parts: Any) -> uuid.UUID:
+        name = self.name(*parts)
+        value = self.cache.get(name)
+        if value is None:
+            value = uuid.uuid5(self.namespace, name)
+            self.cache.put(name, value)
+        return value
+
+    def keys(self, names: Iterable[Tuple[Any, ...]]) -> List[uuid.UUID]:
+        return [self.key(*parts) for parts in names]
+
+    def prime(self, payloads: Iterable[Dict[str, Any]]) -> None:
+        """Считает ключи всех различных сущностей пачки заказов по одному разу."""
+        names = set()
+        for payload in payloads:
+            names.add((payload['user']['id'],))
+            names.add((payload['restaurant']['id'],))
+            names.update((product['id'],) for product in payload['products'])
+            names.update((category['name'],) for category in payload['categories'])
+        for parts in names:
+            self.key(*parts)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+
+# Общий для всех OrderDdsBuilder генератор ключей
+KEY_GENERATOR = DdsKeyGenerator()
@@ -1,98 +1,102 @@
 import uuid
-from pydantic import BaseModel
+from datetime import datetime
+from typing import NamedTuple
 
-class H_User(BaseModel):
+# Строки DDS - NamedTuple: без валидации и лишних аллокаций, порядок полей совпадает
+# с порядком колонок, поэтому строка передаётся в драйвер как есть.
+
+class H_User(NamedTuple):
     h_user_pk: uuid.UUID
     user_id: str
     load_dt: datetime
     load_src: str
 
-class H_Product(BaseModel):
+class H_Product(NamedTuple):
     h_product_pk: uuid.UUID
     product_id: str
     load_dt: datetime
     load_src: str
 
-class H_Category(BaseModel):
+class H_Category(NamedTuple):
     h_category_pk: uuid.UUID
     category_name: str
     load_dt: datetime
     load_src: str
 
-class H_Restaurant(BaseModel):
+class H_Restaurant(NamedTuple):
     h_restaurant_pk: uuid.UUID
     restaurant_id: str
     load_dt: datetime
     load_src: str
 
-class H_Order(BaseModel):
+class H_Order(NamedTuple):
     h_order_pk: uuid.UUID
     order_id: str
     order_dt: datetime
     load_dt: datetime
     load_src: str
 
-class L_Order_Product(BaseModel):
+class L_Order_Product(NamedTuple):
     hk_order_product_pk: uuid.UUID
     h_order_pk: uuid.UUID
     h_product_pk: uuid.UUID
     load_dt: datetime
     load_src: str
 
-class L_Product_Restaurant(BaseModel):
+class L_Product_Restaurant(NamedTuple):
     hk_product_restaurant_pk: uuid.UUID
     h_product_pk: uuid.UUID
     h_restaurant_pk: uuid.UUID
     load_dt: datetime
     load_src: str
 
-class L_Product_Category(BaseModel):
+class L_Product_Category(NamedTuple):
     hk_product_category_pk: uuid.UUID
     h_product_pk: uuid.UUID
     h_category_pk: uuid.UUID
     load_dt: datetime
     load_src: str
 
-class L_Order_User(BaseModel):
+class L_Order_User(NamedTuple):
     hk_order_user_pk: uuid.UUID
     h_order_pk: uuid.UUID
     h_user_pk: uuid.UUID
     load_dt: datetime
     load_src: str
 
-class S_User_Names(BaseModel):
+class S_User_Names(NamedTuple):
     h_user_pk: uuid.UUID
     username: str
     userlogin: str
     load_dt: datetime
     load_src: str
-    hk_user_names_hashdiff: str
+    hk_user_names_hashdiff: uuid.UUID
 
-class S_Product_Names(BaseModel):
+class S_Product_Names(NamedTuple):
     h_product_pk: uuid.UUID
     name: str
     load_dt: datetime
     load_src: str
-    hk_product_names_hashdiff: str
+    hk_product_names_hashdiff: uuid.UUID
 
-class S_Restaurant_Names(BaseModel):
+class S_Restaurant_Names(NamedTuple):
     h_restaurant_pk: uuid.UUID
     name: str
     load_dt: datetime
     load_src: str
-    hk_restaurant_names_hashdiff: str
+    hk_restaurant_names_hashdiff: uuid.UUID
 
-class S_Order_Cost(BaseModel):
+class S_Order_Cost(NamedTuple):
     h_order_pk: uuid.UUID
     cost: float
     payment: float
     load_dt: datetime
     load_src: str
-    hk_order_cost_hashdiff: str
+    hk_order_cost_hashdiff: uuid.UUID
 
-class S_Order_Status(BaseModel):
+class S_Order_Status(NamedTuple):
     h_order_pk: uuid.UUID
     status: str
     load_dt: datetime
     load_src: str
-    hk_order_status_hashdiff: str
\ No newline at end of file
+    hk_order_status_hashdiff: uuid.UUID
\ No newline at end of file
@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Sequence, Tuple
+
+from psycopg import AsyncCursor, Cursor
+
+from lib.kafka_connect import DEFAULT_SERIALIZER
+from lib.metrics import timed
+from lib.pg import PgConnect
+
+OUTBOX_DDL = """
+    CREATE TABLE IF NOT EXISTS dds.outbox (
+        id bigserial PRIMARY KEY,
+        payload bytea NOT NULL,
+        created_at timestamp NOT NULL DEFAULT now(),
+        sent_at timestamp
+    );
+    CREATE INDEX IF NOT EXISTS outbox_unsent_idx ON dds.outbox (id) WHERE sent_at IS NULL;
+"""
+
+OUTBOX_INSERT = "INSERT INTO dds.outbox (payload) VALUES (%s);"
+
+# SKIP LOCKED: несколько релеев разбирают разные строки, не дожидаясь друг друга
+OUTBOX_SELECT = """
+    SELECT id, payload
+    FROM dds.outbox
+    WHERE sent_at IS NULL
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED;
+"""
+
+OUTBOX_MARK_SENT = "UPDATE dds.outbox SET sent_at = now() WHERE id = ANY(%s);"
+
+OUTBOX_PURGE = "DELETE FROM dds.outbox WHERE sent_at < now() - make_interval(hours => %s);"
+
+
+class DdsOutbox:
+    """Исходящие сообщения для CDM в таблице dds.outbox.
+
+    Сообщение пишется той же транзакцией, что и строки хранилища, уже
+    сериализованным: релей отправляет payload в топик без разбора.
+    """
+
+    def __init__(self, serializer=DEFAULT_SERIALIZER) -> None:
+        self._serializer = serializer
+
+    @staticmethod
+    def create_table(db: PgConnect) -> None:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(OUTBOX_DDL)
+
+    def _rows(self, messages: Sequence[Dict[str, Any]]) -> List[Tuple[bytes]]:
+        return [(self._serializer.dumps(message),) for message in messages]
+
+    def write(self, cur: Cursor, messages: Sequence[Dict[str, Any]]) -> None:
+        if messages:
+            with timed('db_outbox'):
+                cur.executemany(OUTBOX_INSERT, self._rows(messages))
+
+    async def write_async(self, cur: AsyncCursor, messages: Sequence[Dict[str, Any]]) -> None:
+        if messages:
+            with timed('db_outbox'):
+                await cur.executemany(OUTBOX_INSERT, self._rows(messages))
+
+    @staticmethod
+    def claim(cur: Cursor, limit: int) -> List[Tuple[int, bytes]]:
+        """Блокирует до limit неотправленных сообщений до конца транзакции."""
+        cur.execute(OUTBOX_SELECT, (limit,))
+        return [(row_id, bytes(payload)) for row_id, payload in cur.fetchall()]
+
+    @staticmethod
+    def mark_sent(cur: Cursor, ids: List[int]) -> None:
+        cur.execute(OUTBOX_MARK_SENT, (ids,))
+
+    @staticmethod
+    def purge(cur: Cursor, retention_hours: int) -> int:
+        cur.execute(OUTBOX_PURGE, (retention_hours,))
+        return cur.rowcount
@@ -0,0 +1,135 @@
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from .dds_batch import TABLES, DdsBatch
+from .dds_keys import KEY_GENERATOR
+from .dds_models import (H_User, H_Product, H_Category, H_Restaurant, H_Order, L_Order_Product,
+                         L_Product_Restaurant, L_Product_Category, L_Order_User, S_User_Names, S_Product_Names,
+                         S_Restaurant_Names, S_Order_Cost, S_Order_Status
+                         )
+
+# Строки таблиц заказа в порядке TABLES: обычные кортежи, UUID - 16 байт
+PackedRows = Tuple[List[Tuple[Any, ...]], ...]
+# Результат сборки одного заказа: ошибка либо строки и итоговое сообщение для CDM
+PackedOrder = Tuple[Optional[Exception], Optional[PackedRows], Optional[Dict[str, Any]]]
+
+
+TABLE_MODELS = dict(zip(TABLES, (H_User, H_Product, H_Category, H_Restaurant, H_Order,
+                                  L_Order_Product, L_Product_Restaurant, L_Product_Category, L_Order_User,
+                                  S_User_Names, S_Product_Names, S_Restaurant_Names, S_Order_Cost, S_Order_Status)))
+
+# Номера полей-UUID в строке каждой таблицы
+UUID_FIELDS = {
+    table: tuple(i for i, field_type in enumerate(model.__annotations__.values()) if field_type is uuid.UUID)
+    for table, model in TABLE_MODELS.items()
+}
+
+
+def _pack_row(row: Tuple[Any, ...], uuid_fields: Tuple[int, ...]) -> Tuple[Any, ...]:
+    values = list(row)
+    for i in uuid_fields:
+        values[i] = values[i].bytes
+    return tuple(values)
+
+
+def _unpack_row(model: type, row: Tuple[Any, ...], uuid_fields: Tuple[int, ...]) -> Tuple[Any, ...]:
+    values = list(row)
+    for i in uuid_fields:
+        values[i] = uuid.UUID(bytes=values[i])
+    return model._make(values)
+
+
+def _pack_dst_msg(dst_msg: Dict[str, Any]) -> Dict[str, Any]:
+    # В топик UUID всё равно уходят строками, поэтому восстанавливать их не нужно
+    return {
+        name: ([str(v) for v in value] if isinstance(value, list) else str(value))
+        if name.endswith('_id') else value
+        for name, value in dst_msg.items()
+    }
+
+
+def _init_worker(key_cache_size: int) -> None:
+    KEY_GENERATOR.cache.set_max_size(key_cache_size)
+
+
+def build_chunk(payloads: List[Dict[str, Any]]) -> List[PackedOrder]:
+    """Собирает строки DDS для части пачки в процессе пула.
+
+    Выполняется в дочернем процессе: ключи берутся из KEY_GENERATOR этого
+    процесса, его кеш живёт между задачами. Заказы собираются независимо,
+    ошибка одного заказа возвращается вместе с остальными результатами.
+    """
+    try:
+        KEY_GENERATOR.prime(payloads)
+    except Exception:
+        # Заказ, на котором упал prime, вернётся с ошибкой ниже
+        pass
+
+    packed = []
+    for payload in payloads:
+        batch = DdsBatch()
+        try:
+            dst_msg = batch.add_order(payload)
+        except Exception as e:
+            packed.append((e, None, None))
+            continue
+
+        rows = tuple([_pack_row(row, UUID_FIELDS[table]) for row in getattr(batch, table)] for table in TABLES)
+        packed.append((None, rows, _pack_dst_msg(dst_msg)))
+    return packed
+
+
+class DdsProcessBuilder:
+    """Сборка строк DDS в пуле процессов.
+
+    Построение строк (uuid5 для каждого товара и пары товар-категория) занимает
+    GIL, поэтому большие заказы собираются в отдельных процессах частями по
+    chunk_size заказов. Между процессами передаются кортежи с UUID в виде байтов,
+    основной процесс только раскладывает их по DdsBatch и занимается вводом-выводом.
+    Если дочерний процесс погиб (например, по OOM), пул пересоздаётся и пачка
+    собирается ещё раз.
+    """
+
+    def __init__(self, processes: int, chunk_size: int = 50, key_cache_size: int = 100_000) -> None:
+        self._processes = processes
+        self._chunk_size = chunk_size
+        self._key_cache_size = key_cache_size
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn: fork процесса с потоками librdkafka и пула соединений небезопасен
+        return ProcessPoolExecutor(
+            max_workers=self._processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self._key_cache_size,)
+        )
+
+    def _map(self, chunks: List[List[Dict[str, Any]]]) -> List[PackedOrder]:
+        results = []
+        for chunk in self._executor.map(build_chunk, chunks):
+            results.extend(chunk)
+        return results
+
+    def build(self, payloads: List[Dict[str, Any]]) -> List[PackedOrder]:
+        chunks = [payloads[i:i + self._chunk_size] for i in range(0, len(payloads), self._chunk_size)]
+        try:
+            return self._map(chunks)
+        except BrokenProcessPool:
+            # Сломанный пул отклоняет все следующие задачи: заменяем его и повторяем пачку один раз
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._create_executor()
+            return self._map(chunks)
+
+    @staticmethod
+    def add_rows(batch: DdsBatch, rows: PackedRows) -> None:
+        for table, table_rows in zip(TABLES, rows):
+            model = TABLE_MODELS[table]
+            uuid_fields = UUID_FIELDS[table]
+            getattr(batch, table).extend(_unpack_row(model, row, uuid_fields) for row in table_rows)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -1,137 +1,355 @@
-from typing import List
-from datetime import datetime
-from dds_models import (H_User, H_Product, H_Category, H_Restaurant, H_Order,  L_Order_Product,
-                        L_Product_Restaurant, L_Product_Restaurant, L_Order_User, S_User_Names, S_Product_Names,
-                        S_Restaurant_Names, S_Order_Cost, S_Order_Status
-                        )
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg import AsyncCursor, Cursor
+
+from lib.metrics import timed
+from lib.pg import PgConnect
+from .dds_batch import DdsBatch
+from .dds_cache import LruCache
+from .dds_outbox import DdsOutbox
+from .dds_models import (H_User, H_Product, H_Category, H_Restaurant, H_Order,  L_Order_Product,
+                         L_Product_Restaurant, L_Product_Category, L_Order_User, S_User_Names, S_Product_Names,
+                         S_Restaurant_Names, S_Order_Cost, S_Order_Status
+                         )
+
+
+# Порядок таблиц важен: сначала хабы, затем линки и сателлиты.
+TABLE_QUERIES: Dict[str, str] = {
+    'h_user': """
+        INSERT INTO dds.h_user (h_user_pk, user_id, load_dt, load_src)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (h_user_pk) DO NOTHING;
+    """,
+    'h_product': """
+        INSERT INTO dds.h_product (h_product_pk, product_id, load_dt, load_src)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (h_product_pk) DO NOTHING;
+    """,
+    'h_category': """
+        INSERT INTO dds.h_category (h_category_pk, category_name, load_dt, load_src)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (h_category_pk) DO NOTHING;
+    """,
+    'h_restaurant': """
+        INSERT INTO dds.h_restaurant (h_restaurant_pk, restaurant_id, load_dt, load_src)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (h_restaurant_pk) DO NOTHING;
+    """,
+    'h_order': """
+        INSERT INTO dds.h_order (h_order_pk, order_id, order_dt, load_dt, load_src)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (h_order_pk) DO NOTHING;
+    """,
+    'l_order_product': """
+        INSERT INTO dds.l_order_product (hk_order_product_pk, h_order_pk, h_product_pk, load_dt, load_src)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hk_order_product_pk) DO NOTHING;
+    """,
+    'l_product_restaurant': """
+        INSERT INTO dds.l_product_restaurant (hk_product_restaurant_pk, h_product_pk, h_restaurant_pk, load_dt, load_src)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hk_product_restaurant_pk) DO NOTHING;
+    """,
+    'l_product_category': """
+        INSERT INTO dds.l_product_category (hk_product_category_pk, h_product_pk, h_category_pk, load_dt, load_src)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hk_product_category_pk) DO NOTHING;
+    """,
+    'l_order_user': """
+        INSERT INTO dds.l_order_user (hk_order_user_pk, h_order_pk, h_user_pk, load_dt, load_src)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hk_order_user_pk) DO NOTHING;
+    """,
+    's_user_names': """
+        INSERT INTO dds.s_user_names (h_user_pk, username, userlogin, load_dt, load_src, hk_user_names_hashdiff)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (hk_user_names_hashdiff) DO NOTHING;
+    """,
+    's_product_names': """
+        INSERT INTO dds.s_product_names (h_product_pk, name, load_dt, load_src, hk_product_names_hashdiff)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hk_product_names_hashdiff) DO NOTHING;
+    """,
+    's_restaurant_names': """
+        INSERT INTO dds.s_restaurant_names (h_restaurant_pk, name, load_dt, load_src, hk_restaurant_names_hashdiff)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hk_restaurant_names_hashdiff) DO NOTHING;
+    """,
+    's_order_cost': """
+        INSERT INTO dds.s_order_cost (h_order_pk, cost, payment, load_dt, load_src, hk_order_cost_hashdiff)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (hk_order_cost_hashdiff) DO NOTHING;
+    """,
+    's_order_status': """
+        INSERT INTO dds.s_order_status (h_order_pk, status, load_dt, load_src, hk_order_status_hashdiff)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (hk_order_status_hashdiff) DO NOTHING;
+    """,
+}
+
+# Колонка, по которой срабатывает ON CONFLICT: дубликаты внутри пачки отбрасываем заранее.
+TABLE_KEYS: Dict[str, str] = {
+    'h_user': 'h_user_pk',
+    'h_product': 'h_product_pk',
+    'h_category': 'h_category_pk',
+    'h_restaurant': 'h_restaurant_pk',
+    'h_order': 'h_order_pk',
+    'l_order_product': 'hk_order_product_pk',
+    'l_product_restaurant': 'hk_product_restaurant_pk',
+    'l_product_category': 'hk_product_category_pk',
+    'l_order_user': 'hk_order_user_pk',
+    's_user_names': 'hk_user_names_hashdiff',
+    's_product_names': 'hk_product_names_hashdiff',
+    's_restaurant_names': 'hk_restaurant_names_hashdiff',
+    's_order_cost': 'hk_order_cost_hashdiff',
+    's_order_status': 'hk_order_status_hashdiff',
+}
+
+# Колонки таблиц в порядке полей моделей: строка-NamedTuple передаётся в executemany как есть.
+TABLE_COLUMNS: Dict[str, List[str]] = {
+    'h_user': ['h_user_pk', 'user_id', 'load_dt', 'load_src'],
+    'h_product': ['h_product_pk', 'product_id', 'load_dt', 'load_src'],
+    'h_category': ['h_category_pk', 'category_name', 'load_dt', 'load_src'],
+    'h_restaurant': ['h_restaurant_pk', 'restaurant_id', 'load_dt', 'load_src'],
+    'h_order': ['h_order_pk', 'order_id', 'order_dt', 'load_dt', 'load_src'],
+    'l_order_product': ['hk_order_product_pk', 'h_order_pk', 'h_product_pk', 'load_dt', 'load_src'],
+    'l_product_restaurant': ['hk_product_restaurant_pk', 'h_product_pk', 'h_restaurant_pk', 'load_dt', 'load_src'],
+    'l_product_category': ['hk_product_category_pk', 'h_product_pk', 'h_category_pk', 'load_dt', 'load_src'],
+    'l_order_user': ['hk_order_user_pk', 'h_order_pk', 'h_user_pk', 'load_dt', 'load_src'],
+    's_user_names': ['h_user_pk', 'username', 'userlogin', 'load_dt', 'load_src', 'hk_user_names_hashdiff'],
+    's_product_names': ['h_product_pk', 'name', 'load_dt', 'load_src', 'hk_product_names_hashdiff'],
+    's_restaurant_names': ['h_restaurant_pk', 'name', 'load_dt', 'load_src', 'hk_restaurant_names_hashdiff'],
+    's_order_cost': ['h_order_pk', 'cost', 'payment', 'load_dt', 'load_src', 'hk_order_cost_hashdiff'],
+    's_order_status': ['h_order_pk', 'status', 'load_dt', 'load_src', 'hk_order_status_hashdiff'],
+}
+
+
+# Почти статичные хабы и линки, для которых имеет смысл помнить уже записанные ключи.
+KNOWN_KEY_TABLES = ('h_user', 'h_product', 'h_category', 'h_restaurant', 'l_product_restaurant', 'l_product_category')
+
+
+class DdsKnownKeys:
+    """Ключи хабов и линков, которые уже точно есть в dds.*.
+
+    Строки с известными ключами не отправляются в Postgres вовсе. Ключ попадает
+    в кеш только после commit транзакции, поэтому откат не оставляет в кеше
+    незаписанных ключей. Потеря кеша безопасна: строки снова уйдут в
+    INSERT ... ON CONFLICT DO NOTHING. Если строки хабов удаляются в обход
+    сервиса, кеш нужно сбросить через invalidate().
+    """
+
+    def __init__(self, max_size: int = 100_000, tables: Tuple[str, ...] = KNOWN_KEY_TABLES) -> None:
+        self._max_size = max_size
+        self._caches: Dict[str, LruCache] = {table: LruCache(max_size) for table in tables}
+
+    def warm_up(self, db: PgConnect) -> None:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                for table, cache in self._caches.items():
+                    cur.execute(f"SELECT {TABLE_KEYS[table]} FROM dds.{table} LIMIT %s;", (self._max_size,))
+                    for (key,) in cur:
+                        cache.put(key, True)
+
+    def unknown_rows(self, table: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        cache = self._caches.get(table)
+        if cache is None:
+            return rows
+        key = TABLE_COLUMNS[table].index(TABLE_KEYS[table])
+        return [row for row in rows if cache.get(row[key]) is None]
+
+    def remember(self, table: str, rows: List[Tuple[Any, ...]]) -> None:
+        cache = self._caches.get(table)
+        if cache is None:
+            return
+        key = TABLE_COLUMNS[table].index(TABLE_KEYS[table])
+        for row in rows:
+            cache.put(row[key], True)
+
+    def invalidate(self) -> None:
+        for cache in self._caches.values():
+            cache.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {table: cache.stats() for table, cache in self._caches.items()}
+
+
+# Сателлиты с редко меняющимися атрибутами: сравниваем hashdiff с последним известным.
+DIFF_SATELLITE_TABLES = ('s_user_names', 's_product_names', 's_restaurant_names')
+
+
+class DdsSatelliteCache:
+    """Последний hashdiff каждого сателлита по ключу родительского хаба.
+
+    Кеш заполняется лениво: для ключей, которых в нём нет, последний hashdiff
+    читается из dds.s_* той же транзакцией. Дальше в Postgres уходят только
+    строки, hashdiff которых отличается от последнего. Как и DdsKnownKeys,
+    кеш обновляется только после commit.
+    """
+
+    def __init__(self, max_size: int = 100_000, tables: Tuple[str, ...] = DIFF_SATELLITE_TABLES) -> None:
+        self._caches: Dict[str, LruCache] = {table: LruCache(max_size) for table in tables}
+
+    @staticmethod
+    def _last_hashdiff_query(table: str) -> str:
+        parent = TABLE_COLUMNS[table][0]
+        hashdiff = TABLE_KEYS[table]
+        return f"""
+            SELECT DISTINCT ON ({parent}) {parent}, {hashdiff}
+            FROM dds.{table}
+            WHERE {parent} = ANY(%s)
+            ORDER BY {parent}, load_dt DESC;
+        """
+
+    @staticmethod
+    def _missing(cache: LruCache, rows: List[Tuple[Any, ...]]) -> List[Any]:
+        return list({row[0] for row in rows if cache.get(row[0]) is None})
+
+    @staticmethod
+    def _changed(cache: LruCache, table: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        hashdiff = TABLE_COLUMNS[table].index(TABLE_KEYS[table])
+        return [row for row in rows if cache.get(row[0]) != row[hashdiff]]
+
+    def changed_rows(self, cur: Cursor, table: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        cache = self._caches.get(table)
+        if cache is None or not rows:
+            return rows
+
+        missing = self._missing(cache, rows)
+        if missing:
+            cur.execute(self._last_hashdiff_query(table), (missing,))
+            for parent_key, hashdiff_value in cur.fetchall():
+                cache.put(parent_key, hashdiff_value)
+
+        return self._changed(cache, table, rows)
+
+    async def changed_rows_async(self, cur: AsyncCursor, table: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        cache = self._caches.get(table)
+        if cache is None or not rows:
+            return rows
+
+        missing = self._missing(cache, rows)
+        if missing:
+            await cur.execute(self._last_hashdiff_query(table), (missing,))
+            for parent_key, hashdiff_value in await cur.fetchall():
+                cache.put(parent_key, hashdiff_value)
+
+        return self._changed(cache, table, rows)
+
+    def remember(self, table: str, rows: List[Tuple[Any, ...]]) -> None:
+        cache = self._caches.get(table)
+        if cache is None:
+            return
+        hashdiff = TABLE_COLUMNS[table].index(TABLE_KEYS[table])
+        for row in rows:
+            cache.put(row[0], row[hashdiff])
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {table: cache.stats() for table, cache in self._caches.items()}
 
 
 class DdsRepository:
-    def __init__(self, db: PgConnect) -> None:
+    def __init__(self,
+                 db: PgConnect,
+                 known_keys: Optional[DdsKnownKeys] = None,
+                 satellites: Optional[DdsSatelliteCache] = None,
+                 outbox: Optional[DdsOutbox] = None) -> None:
         self._db = db
+        self._known_keys = known_keys
+        self._satellites = satellites
+        self._outbox = outbox
+        # Изменённые и неизменённые строки сателлитов в последней пачке
+        self.satellite_stats: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def writes_outbox(self) -> bool:
+        """Сообщения для CDM пишутся в dds.outbox вместе с пачкой, в топик их отправляет релей."""
+        return self._outbox is not None
+
+    @staticmethod
+    def unique_rows(table: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        key = TABLE_COLUMNS[table].index(TABLE_KEYS[table])
+        unique = {}
+        for row in rows:
+            unique.setdefault(row[key], row)
+        return list(unique.values())
 
-    def _execute_query(self, query: str, params: dict) -> None:
+    def _write_rows(self, cur: Cursor, table: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        rows = self.unique_rows(table, rows)
+        if self._known_keys is not None:
+            rows = self._known_keys.unknown_rows(table, rows)
+        if self._satellites is not None and table in DIFF_SATELLITE_TABLES:
+            changed = self._satellites.changed_rows(cur, table, rows)
+            self.satellite_stats[table] = {'changed': len(changed), 'unchanged': len(rows) - len(changed)}
+            rows = changed
+        if rows:
+            # executemany в psycopg 3 отправляет все строки в pipeline-режиме, без round trip на каждую.
+            with timed(f'db_{table}'):
+                cur.executemany(TABLE_QUERIES[table], rows)
+        return rows
+
+    def _remember(self, written: Dict[str, List[Tuple[Any, ...]]]) -> None:
+        # Вызывается только после успешного commit
+        for table, rows in written.items():
+            if self._known_keys is not None:
+                self._known_keys.remember(table, rows)
+            if self._satellites is not None:
+                self._satellites.remember(table, rows)
+
+    def _insert_rows(self, table: str, rows: List[Tuple[Any, ...]]) -> None:
         with self._db.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(query, params)
-                conn.commit()
+                written = self._write_rows(cur, table, rows)
+        self._remember({table: written})
+
+    def insert_batch(self, batch: DdsBatch, messages: Sequence[Dict[str, Any]] = ()) -> None:
+        written = {}
+        self.satellite_stats = {}
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                for table in TABLE_QUERIES:
+                    written[table] = self._write_rows(cur, table, getattr(batch, table))
+                if self._outbox is not None:
+                    self._outbox.write(cur, messages)
+        self._remember(written)
 
     def insert_h_user(self, user: H_User) -> None:
-        query = """
-            INSERT INTO dds.h_user (h_user_pk, user_id, load_dt, load_src)
-            VALUES (%(h_user_pk)s, %(user_id)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (h_user_pk) DO NOTHING;
-        """
-        self._execute_query(query, user.dict())
+        self._insert_rows('h_user', [user])
 
     def insert_h_product(self, products: List[H_Product]) -> None:
-        query = """
-            INSERT INTO dds.h_product (h_product_pk, product_id, load_dt, load_src)
-            VALUES (%(h_product_pk)s, %(product_id)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (h_product_pk) DO NOTHING;
-        """
-        for product in products:
-            self._execute_query(query, product.dict())
+        self._insert_rows('h_product', products)
 
     def insert_h_category(self, categories: List[H_Category]) -> None:
-        query = """
-            INSERT INTO dds.h_category (h_category_pk, category_name, load_dt, load_src)
-            VALUES (%(h_category_pk)s, %(category_name)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (h_category_pk) DO NOTHING;
-        """
-        for category in categories:
-            self._execute_query(query, category.dict())
+        self._insert_rows('h_category', categories)
 
     def insert_h_restaurant(self, restaurant: H_Restaurant) -> None:
-        query = """
-            INSERT INTO dds.h_restaurant (h_restaurant_pk, restaurant_id, load_dt, load_src)
-            VALUES (%(h_restaurant_pk)s, %(restaurant_id)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (h_restaurant_pk) DO NOTHING;
-        """
-        self._execute_query(query, restaurant.dict())
+        self._insert_rows('h_restaurant', [restaurant])
 
     def insert_h_order(self, order: H_Order) -> None:
-        query = """
-            INSERT INTO dds.h_order (h_order_pk, order_id, order_dt, load_dt, load_src)
-            VALUES (%(h_order_pk)s, %(order_id)s, %(order_dt)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (h_order_pk) DO NOTHING;
-        """
-        self._execute_query(query, order.dict())
+        self._insert_rows('h_order', [order])
 
     def insert_l_order_product(self, links: List[L_Order_Product]) -> None:
-        query = """
-            INSERT INTO dds.l_order_product (hk_order_product_pk, h_order_pk, h_product_pk, load_dt, load_src)
-            VALUES (%(hk_order_product_pk)s, %(h_order_pk)s, %(h_product_pk)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (hk_order_product_pk) DO NOTHING;
-        """
-        for link in links:
-            self._execute_query(query, link.dict())
+        self._insert_rows('l_order_product', links)
 
     def insert_l_product_restaurant(self, links: List[L_Product_Restaurant]) -> None:
-        query = """
-            INSERT INTO dds.l_product_restaurant (hk_product_restaurant_pk, h_product_pk, h_restaurant_pk, load_dt, load_src)
-            VALUES (%(hk_product_restaurant_pk)s, %(h_product_pk)s, %(h_restaurant_pk)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (hk_product_restaurant_pk) DO NOTHING;
-        """
-        for link in links:
-            self._execute_query(query, link.dict())
+        self._insert_rows('l_product_restaurant', links)
 
     def insert_l_product_category(self, links: List[L_Product_Category]) -> None:
-        query = """
-            INSERT INTO dds.l_product_category (hk_product_category_pk, h_product_pk, h_category_pk, load_dt, load_src)
-            VALUES (%(hk_product_category_pk)s, %(h_product_pk)s, %(h_category_pk)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (hk_product_category_pk) DO NOTHING;
-        """
-        for link in links:
-            self._execute_query(query, link.dict())
+        self._insert_rows('l_product_category', links)
 
     def insert_l_order_user(self, link: L_Order_User) -> None:
-        query = """
-            INSERT INTO dds.l_order_user (hk_order_user_pk, h_order_pk, h_user_pk, load_dt, load_src)
-            VALUES (%(hk_order_user_pk)s, %(h_order_pk)s, %(h_user_pk)s, %(load_dt)s, %(load_src)s)
-            ON CONFLICT (hk_order_user_pk) DO NOTHING;
-        """
-        self._execute_query(query, link.dict())
+        self._insert_rows('l_order_user', [link])
 
     def insert_s_user_names(self, user_names: S_User_Names) -> None:
-        query = """
-            INSERT INTO dds.s_user_names (h_user_pk, username, userlogin, load_dt, load_src, hk_user_names_hashdiff)
-            VALUES (%(h_user_pk)s, %(username)s, %(userlogin)s, %(load_dt)s, %(load_src)s, %(hk_user_names_hashdiff)s)
-            ON CONFLICT (hk_user_names_hashdiff) DO NOTHING;
-        """
-        self._execute_query(query, user_names.dict())
+        self._insert_rows('s_user_names', [user_names])
 
     def insert_s_product_names(self, product_names: List[S_Product_Names]) -> None:
-        query = """
-            INSERT INTO dds.s_product_names (h_product_pk, name, load_dt, load_src, hk_product_names_hashdiff)
-            VALUES (%(h_product_pk)s, %(name)s, %(load_dt)s, %(load_src)s, %(hk_product_names_hashdiff)s)
-            ON CONFLICT (hk_product_names_hashdiff) DO NOTHING;
-        """
-        for product_name in product_names:
-            self._execute_query(query, product_name.dict())
+        self._insert_rows('s_product_names', product_names)
 
     def insert_s_restaurant_names(self, restaurant_names: S_Restaurant_Names) -> None:
-        query = """
-            INSERT INTO dds.s_restaurant_names (h_restaurant_pk, name, load_dt, load_src, hk_restaurant_names_hashdiff)
-            VALUES (%(h_restaurant_pk)s, %(name)s, %(load_dt)s, %(load_src)s, %(hk_restaurant_names_hashdiff)s)
-            ON CONFLICT (hk_restaurant_names_hashdiff) DO NOTHING;
-        """
-        self._execute_query(query, restaurant_names.dict())
+        self._insert_rows('s_restaurant_names', [restaurant_names])
 
     def insert_s_order_cost(self, order_cost: S_Order_Cost) -> None:
-        query = """
-            INSERT INTO dds.s_order_cost (h_order_pk, cost, payment, load_dt, load_src, hk_order_cost_hashdiff)
-            VALUES (%(h_order_pk)s, %(cost)s, %(payment)s, %(load_dt)s, %(load_src)s, %(hk_order_cost_hashdiff)s)
-            ON CONFLICT (hk_order_cost_hashdiff) DO NOTHING;
-        """
-        self._execute_query(query, order_cost.dict())
+        self._insert_rows('s_order_cost', [order_cost])
 
     def insert_s_order_status(self, order_status: S_Order_Status) -> None:
-        query = """
-            INSERT INTO dds.s_order_status (h_order_pk, status, load_dt, load_src, hk_order_status_hashdiff)
-            VALUES (%(h_order_pk)s, %(status)s, %(load_dt)s, %(load_src)s, %(hk_order_status_hashdiff)s)
-            ON CONFLICT (hk_order_status_hashdiff) DO NOTHING;
-        """
-        self._execute_query(query, order_status.dict())
-
-
+        self._insert_rows('s_order_status', [order_status])
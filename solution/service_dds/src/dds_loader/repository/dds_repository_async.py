@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg import AsyncCursor
+
+from lib.metrics import timed
+from lib.pg import AsyncPgConnect
+from .dds_batch import DdsBatch
+from .dds_outbox import DdsOutbox
+from .dds_repository import DIFF_SATELLITE_TABLES, TABLE_QUERIES, DdsKnownKeys, DdsRepository, DdsSatelliteCache
+
+
+class AsyncDdsRepository:
+    """DdsRepository для asyncio-конвейера: те же запросы и кеши, но AsyncConnection.
+
+    Пока пачка ждёт Postgres, event loop собирает следующую и отправляет предыдущую.
+    """
+
+    def __init__(self,
+                 db: AsyncPgConnect,
+                 known_keys: Optional[DdsKnownKeys] = None,
+                 satellites: Optional[DdsSatelliteCache] = None,
+                 outbox: Optional[DdsOutbox] = None) -> None:
+        self._db = db
+        self._known_keys = known_keys
+        self._satellites = satellites
+        self._outbox = outbox
+        self.satellite_stats: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def writes_outbox(self) -> bool:
+        return self._outbox is not None
+
+    async def _write_rows(self, cur: AsyncCursor, table: str, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        rows = DdsRepository.unique_rows(table, rows)
+        if self._known_keys is not None:
+            rows = self._known_keys.unknown_rows(table, rows)
+        if self._satellites is not None and table in DIFF_SATELLITE_TABLES:
+            changed = await self._satellites.changed_rows_async(cur, table, rows)
+            self.satellite_stats[table] = {'changed': len(changed), 'unchanged': len(rows) - len(changed)}
+            rows = changed
+        if rows:
+            with timed(f'db_{table}'):
+                await cur.executemany(TABLE_QUERIES[table], rows)
+        return rows
+
+    async def insert_batch(self, batch: DdsBatch, messages: Sequence[Dict[str, Any]] = ()) -> None:
+        written = {}
+        self.satellite_stats = {}
+        async with self._db.connection() as conn:
+            async with conn.cursor() as cur:
+                for table in TABLE_QUERIES:
+                    written[table] = await self._write_rows(cur, table, getattr(batch, table))
+                if self._outbox is not None:
+                    await self._outbox.write_async(cur, messages)
+
+        # Кеши обновляются только после commit
+        for table, rows in written.items():
+            if self._known_keys is not None:
+                self._known_keys.remember(table, rows)
+            if self._satellites is not None:
+                self._satellites.remember(table, rows)
@@ -0,0 +1,43 @@
+from datetime import datetime
+from typing import Any, Dict, List, Union
+
+from pydantic import BaseModel
+
+
+# Схема входящего заказа. Строки DDS больше не валидируются при создании,
+# поэтому при необходимости заказ проверяется один раз при чтении из топика.
+
+class UserPayload(BaseModel):
+    id: Union[str, int]
+    name: str
+    login: str
+
+class RestaurantPayload(BaseModel):
+    id: Union[str, int]
+    name: str
+
+class OrderInfoPayload(BaseModel):
+    id: Union[str, int]
+    date: datetime
+    cost: float
+    payment: float
+
+class ProductPayload(BaseModel):
+    id: Union[str, int]
+    name: str
+    quantity: int
+
+class CategoryPayload(BaseModel):
+    name: str
+
+class OrderPayload(BaseModel):
+    user: UserPayload
+    restaurant: RestaurantPayload
+    order: OrderInfoPayload
+    products: List[ProductPayload]
+    categories: List[CategoryPayload]
+    status: str
+
+
+def validate_order_payload(payload: Dict[str, Any]) -> None:
+    OrderPayload(**payload)
@@ -1 +1,9 @@
-from .kafka_connectors import KafkaConsumer, KafkaProducer  # noqa
+from .kafka_connectors import DeliveryScope, KafkaConsumer, KafkaDeliveryError, KafkaMessage, KafkaProducer  # noqa
+from .async_pipeline import AsyncKafkaProducer, AsyncMessageSource, AsyncPipeline  # noqa
+from .backpressure import AdaptiveBatchSizer  # noqa
+from .dead_letter import (DeadLetterSink, FileDeadLetterSink, KafkaDeadLetterSink, RetryPolicy,  # noqa
+                          dead_letter_record)
+from .offsets import OffsetTracker  # noqa
+from .sources import FileSource, MessageSource  # noqa
+from .streaming import StreamingLoop  # noqa
+from .serializers import DEFAULT_SERIALIZER, get_serializer  # noqa
@@ -0,0 +1,329 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from .kafka_connectors import KafkaMessage, KafkaProducer
+from .offsets import OffsetTracker
+from .sources import MessageSource
+
+# Стадия конвейера: получает сообщения пачки и результат предыдущей стадии
+Stage = Callable[[List[KafkaMessage], Any], Awaitable[Any]]
+# Поколения партиций: увеличиваются при каждом возврате партиции к зафиксированному оффсету
+Generations = Dict[Tuple[str, int], int]
+
+
+class AsyncMessageSource:
+    """MessageSource для asyncio: блокирующие вызовы выполняются в отдельном потоке.
+
+    Поток у источника один, поэтому вызовы librdkafka не перемежаются между собой.
+    """
+
+    def __init__(self, source: MessageSource) -> None:
+        self.source = source
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-source')
+
+    async def _call(self, func: Callable, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def consume_batch(self, num_messages: int, timeout: float = 1.0) -> List[KafkaMessage]:
+        return await self._call(self.source.consume_batch, num_messages, timeout)
+
+    async def commit_offsets(self, offsets: Dict[Tuple[str, int], int]) -> None:
+        if offsets:
+            await self._call(self.source.commit_offsets, offsets)
+
+    async def rewind(self, partitions: Set[Tuple[str, int]]) -> None:
+        await self._call(self.source.rewind, partitions)
+
+    async def pause(self) -> None:
+        await self._call(self.source.pause)
+
+    async def resume(self) -> None:
+        await self._call(self.source.resume)
+
+    async def close(self) -> None:
+        await self._call(self.source.close)
+        self._executor.shutdown(wait=False)
+
+
+class AsyncKafkaProducer:
+    """produce и так не блокирует; flush ждёт доставки в отдельном потоке.
+
+    Все полосы работают в одном потоке event loop, поэтому у каждой обёртки свой
+    DeliveryScope: flush полосы проверяет доставку только её сообщений.
+    """
+
+    def __init__(self, producer: KafkaProducer) -> None:
+        self._producer = producer
+        self._scope = producer.delivery_scope()
+
+    def produce(self, payload: Dict) -> None:
+        self._producer.produce(payload, self._scope)
+
+    async def flush(self, timeout: float = 30.0) -> None:
+        await asyncio.to_thread(self._producer.flush, timeout, self._scope)
+
+
+class AsyncPipeline:
+    """Конвейер на asyncio: чтение, сборка, запись и отправка разных пачек идут одновременно.
+
+    Сообщения раскладываются по lanes по номеру партиции. В каждой полосе свои
+    стадии (stages_factory), соединённые очередями размера queue_size, и каждая
+    стадия обрабатывает пачки строго по очереди, поэтому порядок внутри партиции
+    сохраняется. Пачка, упавшая на стадии, повторяется на ней же после паузы, а после
+    max_retries попыток бросается, и её партиции перечитываются с зафиксированных
+    оффсетов. Пачки помечаются поколениями своих партиций: после возврата партиции
+    пачки старых поколений, уже стоящие в очередях стадий, пропускаются без записи
+    и без отметки в OffsetTracker. Если очередь полосы заполнена, чтение ставится на паузу.
+    Оффсеты фиксируются через OffsetTracker, когда пачка прошла последнюю стадию.
+    """
+
+    def __init__(self,
+                 source: MessageSource,
+                 stages_factory: Callable[[], Sequence[Stage]],
+                 logger: Logger,
+                 lanes: int = 1,
+                 batch_size: int = 100,
+                 queue_size: int = 4,
+                 poll_timeout: float = 1.0,
+                 error_backoff: float = 5.0,
+                 max_retries: int = 3,
+                 drain_timeout: float = 60.0,
+                 on_close: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+        self._source = AsyncMessageSource(source)
+        self._lane_stages = [stages_factory() for _ in range(lanes)]
+        self._logger = logger
+        self._batch_size = batch_size
+        self._queue_size = queue_size
+        self._poll_timeout = poll_timeout
+        self._error_backoff = error_backoff
+        self._max_retries = max_retries
+        self._drain_timeout = drain_timeout
+        self._on_close = on_close
+
+        self._tracker = OffsetTracker()
+        # Пачки, не поместившиеся в заполненную очередь полосы, поколения партиций и партиции
+        # брошенных пачек, ждущие возврата. Меняются только в потоке event loop.
+        self._backlog: List[Deque[Tuple[List[KafkaMessage], Generations]]] = [deque() for _ in range(lanes)]
+        self._inboxes: List[asyncio.Queue] = []
+        self._generations: Generations = {}
+        self._rewinds: Set[Tuple[str, int]] = set()
+        self._paused = False
+        self._stop = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),), name='async-pipeline', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    async def _stage(self, stage: Stage, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]) -> None:
+        abandoned = False
+        while True:
+            item = await inbox.get()
+            if item is None:
+                if outbox is not None:
+                    await outbox.put(None)
+                return
+            if abandoned:
+                # При остановке после ошибки дочитываем очередь, чтобы не заблокировать предыдущую стадию
+                continue
+
+            messages, state, generations = item
+            stale = self._stale(generations)
+            if stale:
+                # Результат предыдущей стадии общий на пачку, поэтому она бросается целиком,
+                # а её ещё актуальные партиции тоже возвращаются и перечитываются
+                self._rewinds.update(key for key in generations if key not in stale)
+                continue
+
+            attempt = 0
+            failed = False
+            while True:
+                try:
+                    state = await stage(messages, state)
+                    break
+                except Exception:
+                    attempt += 1
+                    self._logger.exception(f"Pipeline stage failed, attempt {attempt}")
+                    if attempt >= self._max_retries:
+                        # Бросаем пачку: оффсеты не отмечены, цикл чтения перечитает её партиции
+                        self._logger.error(f"Giving up on {len(messages)} messages, rewinding")
+                        self._rewinds.update((msg.topic, msg.partition) for msg in messages)
+                        failed = True
+                        break
+                    await asyncio.sleep(self._error_backoff)
+                    if self._stop.is_set():
+                        # Оффсеты пачки не зафиксированы, она будет прочитана заново
+                        abandoned = True
+                        break
+            if abandoned or failed:
+                continue
+
+            if outbox is not None:
+                await outbox.put((messages, state, generations))
+            else:
+                # Партиция могла вернуться, пока шла запись: её сообщения прочитаны заново
+                stale = self._stale(generations)
+                for msg in messages:
+                    if (msg.topic, msg.partition) not in stale:
+                        self._tracker.done(msg.topic, msg.partition, msg.offset)
+
+    def _stale(self, generations: Generations) -> Set[Tuple[str, int]]:
+        return {key for key, generation in generations.items()
+                if key in self._rewinds or self._generations.get(key, 0) != generation}
+
+    async def _commit(self) -> None:
+        try:
+            await self._source.commit_offsets(self._tracker.pop_committable())
+        except Exception:
+            self._logger.exception("Offset commit failed")
+
+    def _dispatch(self, lane: int, messages: List[KafkaMessage]) -> None:
+        # Цикл чтения не ждёт заполненную очередь: пачка ждёт в backlog полосы,
+        # а следующие пачки полосы встают за ней, чтобы не нарушить порядок.
+        generations = {key: self._generations.get(key, 0) for key in {(msg.topic, msg.partition) for msg in messages}}
+        backlog = self._backlog[lane]
+        if not backlog:
+            try:
+                self._inboxes[lane].put_nowait((messages, None, generations))
+                return
+            except asyncio.QueueFull:
+                pass
+        backlog.append((messages, generations))
+
+    def _flush_backlog(self) -> None:
+        for inbox, backlog in zip(self._inboxes, self._backlog):
+            while backlog:
+                messages, generations = backlog[0]
+                try:
+                    inbox.put_nowait((messages, None, generations))
+                except asyncio.QueueFull:
+                    break
+                backlog.popleft()
+
+    def _drop(self, partitions: Set[Tuple[str, int]]) -> None:
+        # Сообщения этих партиций в backlog ещё не розданы полосам и будут прочитаны заново,
+        # а уже розданные устаревают вместе с поколением партиции
+        for lane, backlog in enumerate(self._backlog):
+            shards = []
+            for messages, generations in backlog:
+                messages = [msg for msg in messages if (msg.topic, msg.partition) not in partitions]
+                if messages:
+                    shards.append((messages, {key: g for key, g in generations.items() if key not in partitions}))
+            self._backlog[lane] = deque(shards)
+        for key in partitions:
+            self._generations[key] = self._generations.get(key, 0) + 1
+        self._rewinds -= partitions
+        self._tracker.forget(partitions)
+
+    async def _apply_rewinds(self) -> None:
+        if not self._rewinds:
+            return
+        # Партиции остаются в _rewinds до _drop: пока идёт rewind, стадии пропускают их пачки
+        partitions = set(self._rewinds)
+        try:
+            await self._source.rewind(partitions)
+        except Exception:
+            # Повторим на следующей итерации
+            self._logger.exception("Rewind failed")
+            return
+        self._drop(partitions)
+        self._logger.info(f"Rewound partitions {sorted(p for _, p in partitions)}")
+
+    async def _apply_backpressure(self) -> None:
+        # Очередь полосы заполнена: ставим партиции на паузу, но продолжаем poll,
+        # чтобы под оставался в группе. Снимаем паузу, когда backlog разобран.
+        backlog = any(self._backlog)
+        if backlog and not self._paused:
+            await self._source.pause()
+            self._paused = True
+            self._logger.info("Paused consumption, lane queue is full")
+        elif not backlog and self._paused:
+            await self._source.resume()
+            self._paused = False
+            self._logger.info("Resumed consumption")
+
+    async def _wait_idle(self) -> None:
+        while self._tracker.in_flight() and not self._stop.is_set():
+            # Цикл чтения стоит в poll, поэтому backlog раздаём отсюда
+            self._flush_backlog()
+            await asyncio.sleep(0.05)
+
+    async def _revoke(self, partitions: Set[Tuple[str, int]]) -> Dict[Tuple[str, int], int]:
+        try:
+            await asyncio.wait_for(self._wait_idle(), self._drain_timeout)
+        except asyncio.TimeoutError:
+            self._logger.warning("Lanes did not drain in time, unfinished messages will be read again")
+        offsets = self._tracker.pop_committable()
+        self._drop(partitions)
+        return offsets
+
+    def _on_assign(self, consumer, partitions) -> None:
+        # Новое назначение приходит без паузы, при необходимости цикл чтения поставит её снова
+        self._paused = False
+
+    def _on_revoke(self, consumer, partitions) -> None:
+        # Вызывается в потоке источника во время poll: ждём не дольше drain_timeout, пока полосы
+        # доработают розданные пачки, и фиксируем их до передачи партиций другому поду
+        revoked = {(tp.topic, tp.partition) for tp in partitions}
+        offsets = asyncio.run_coroutine_threadsafe(self._revoke(revoked), self._loop).result()
+        if offsets:
+            self._source.source.commit_offsets(offsets)
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._source.source.set_rebalance_callbacks(on_assign=self._on_assign, on_revoke=self._on_revoke)
+
+        lanes = []
+        for stages in self._lane_stages:
+            queues = [asyncio.Queue(maxsize=self._queue_size) for _ in stages]
+            outboxes = queues[1:] + [None]
+            tasks = [asyncio.create_task(self._stage(stage, inbox, outbox))
+                     for stage, inbox, outbox in zip(stages, queues, outboxes)]
+            lanes.append((queues[0], tasks))
+            self._inboxes.append(queues[0])
+
+        while not self._stop.is_set():
+            await self._apply_rewinds()
+            self._flush_backlog()
+            await self._apply_backpressure()
+            try:
+                messages = await self._source.consume_batch(self._batch_size, self._poll_timeout)
+            except Exception:
+                self._logger.exception("Kafka poll failed")
+                await asyncio.sleep(self._error_backoff)
+                continue
+
+            shards: List[List[KafkaMessage]] = [[] for _ in lanes]
+            for msg in messages:
+                if (msg.topic, msg.partition) in self._rewinds:
+                    # Партиция ждёт возврата, сообщение будет прочитано заново
+                    continue
+                self._tracker.track(msg.topic, msg.partition, msg.offset)
+                shards[msg.partition % len(lanes)].append(msg)
+            for lane, shard in enumerate(shards):
+                if shard:
+                    self._dispatch(lane, shard)
+
+            await self._commit()
+
+        # Graceful shutdown: дорабатываем розданные пачки и фиксируем их оффсеты.
+        # Пачки из backlog не розданы и будут прочитаны заново.
+        for inbox, _ in lanes:
+            await inbox.put(None)
+        for _, tasks in lanes:
+            await asyncio.gather(*tasks)
+        await self._commit()
+        await self._source.close()
+        if self._on_close is not None:
+            await self._on_close()
+        self._logger.info("Async pipeline stopped")
@@ -0,0 +1,37 @@
+import threading
+
+
+class AdaptiveBatchSizer:
+    """Размер пачки по схеме AIMD по времени обработки пачки (запись в БД + commit).
+
+    Пока пачки приходят полными (есть отставание) и обрабатываются быстрее
+    target_latency_ms, размер растёт на step. Как только время обработки
+    превышает цель, размер уменьшается в decrease_factor раз.
+    """
+
+    def __init__(self,
+                 initial_size: int,
+                 min_size: int = 10,
+                 max_size: int = 1000,
+                 target_latency_ms: int = 1000,
+                 step: int = 10,
+                 decrease_factor: float = 0.5) -> None:
+        self._min_size = min_size
+        self._max_size = max_size
+        self._target = target_latency_ms / 1000
+        self._step = step
+        self._decrease_factor = decrease_factor
+        self._size = max(min_size, min(max_size, initial_size))
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def record(self, batch_len: int, latency: float) -> int:
+        with self._lock:
+            if latency > self._target:
+                self._size = max(self._min_size, int(self._size * self._decrease_factor))
+            elif batch_len >= self._size:
+                self._size = min(self._max_size, self._size + self._step)
+            return self._size
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Protocol, Tuple, Type, TypeVar
+
+from lib.metrics import MESSAGES_DEAD_LETTERED
+from .kafka_connectors import DeliveryScope, KafkaMessage, KafkaProducer
+
+T = TypeVar('T')
+
+
+def _text(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.decode(errors='replace')
+    return value
+
+
+def dead_letter_record(msg: KafkaMessage, error: BaseException, stage: str) -> Dict[str, Any]:
+    """Исходное сообщение как есть плюс метаданные ошибки, чтобы его можно было разобрать и переиграть."""
+    return {
+        'topic': msg.topic,
+        'partition': msg.partition,
+        'offset': msg.offset,
+        'key': _text(msg.key),
+        'headers': [[name, _text(value)] for name, value in msg.headers or ()],
+        'value': _text(msg.value),
+        'stage': stage,
+        'error_type': type(error).__name__,
+        'error': str(error),
+        'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__)),
+        'failed_at': datetime.utcnow().isoformat(),
+    }
+
+
+class DeadLetterSink(Protocol):
+    def send(self, msg: KafkaMessage, error: BaseException, stage: str) -> None:
+        ...
+
+    def flush(self) -> None:
+        ...
+
+    def scoped(self) -> 'DeadLetterSink':
+        """Sink для одного процессора: flush проверяет только отправленное через него."""
+        ...
+
+
+class KafkaDeadLetterSink:
+    """Отправляет непрошедшие сообщения в DLQ-топик."""
+
+    def __init__(self, producer: KafkaProducer, scope: Optional[DeliveryScope] = None) -> None:
+        self._producer = producer
+        self._scope = scope
+
+    def send(self, msg: KafkaMessage, error: BaseException, stage: str) -> None:
+        self._producer.produce(dead_letter_record(msg, error, stage), self._scope)
+        MESSAGES_DEAD_LETTERED.labels(stage).inc()
+
+    def flush(self) -> None:
+        self._producer.flush(scope=self._scope)
+
+    def scoped(self) -> 'KafkaDeadLetterSink':
+        # send и flush могут идти из разных потоков (asyncio.to_thread), поэтому scope явный
+        return KafkaDeadLetterSink(self._producer, self._producer.delivery_scope())
+
+
+class FileDeadLetterSink:
+    """Дописывает непрошедшие сообщения в локальный JSONL-файл."""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def send(self, msg: KafkaMessage, error: BaseException, stage: str) -> None:
+        line = json.dumps(dead_letter_record(msg, error, stage), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+        MESSAGES_DEAD_LETTERED.labels(stage).inc()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+
+    def scoped(self) -> 'FileDeadLetterSink':
+        return self
+
+
+class RetryPolicy:
+    """Ограниченное число повторов с экспоненциальной паузой между ними.
+
+    Исключения из fatal не повторяются и пробрасываются сразу: например, потеря
+    соединения с БД, при которой повторять нужно всю пачку, а не одно сообщение.
+    """
+
+    def __init__(self, retries: int = 2, backoff: float = 0.5, max_backoff: float = 5.0) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def call(self, func: Callable[[], T], fatal: Tuple[Type[BaseException], ...] = ()) -> T:
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except fatal:
+                raise
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt))
+                attempt += 1
+
+    async def call_async(self, func: Callable[[], Awaitable[T]], fatal: Tuple[Type[BaseException], ...] = ()) -> T:
+        attempt = 0
+        while True:
+            try:
+                return await func()
+            except fatal:
+                raise
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(min(self.max_backoff, self.backoff * 2 ** attempt))
+                attempt += 1
@@ -0,0 +1,56 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, Set, Tuple
+
+TopicPartitionKey = Tuple[str, int]
+
+
+class OffsetTracker:
+    """Учёт обработанных оффсетов при параллельной обработке.
+
+    Оффсеты регистрируются в порядке чтения (track) и отмечаются готовыми в
+    любом порядке (done). Для фиксации отдаётся только непрерывный префикс
+    готовых оффсетов каждой партиции, поэтому commit никогда не перепрыгивает
+    через необработанное сообщение.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: Dict[TopicPartitionKey, Deque[int]] = {}
+        self._done: Dict[TopicPartitionKey, Set[int]] = {}
+        self._committable: Dict[TopicPartitionKey, int] = {}
+
+    def track(self, topic: str, partition: int, offset: int) -> None:
+        with self._lock:
+            self._pending.setdefault((topic, partition), deque()).append(offset)
+
+    def done(self, topic: str, partition: int, offset: int) -> None:
+        key = (topic, partition)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                return
+            done = self._done.setdefault(key, set())
+            done.add(offset)
+            while pending and pending[0] in done:
+                last = pending.popleft()
+                done.discard(last)
+                # В Kafka фиксируется следующий оффсет для чтения
+                self._committable[key] = last + 1
+
+    def pop_committable(self) -> Dict[TopicPartitionKey, int]:
+        with self._lock:
+            offsets = self._committable
+            self._committable = {}
+            return offsets
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def forget(self, partitions: Iterable[TopicPartitionKey]) -> None:
+        with self._lock:
+            for key in partitions:
+                self._pending.pop(key, None)
+                self._done.pop(key, None)
+                self._committable.pop(key, None)
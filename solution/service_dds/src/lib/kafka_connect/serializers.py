@@ -0,0 +1,92 @@
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class JsonSerializer:
+    """Стандартный json: разбирает bytes без промежуточного str, UUID и datetime пишет строками."""
+
+    name = 'json'
+
+    @staticmethod
+    def _default(obj: Any) -> Any:
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        if isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        if isinstance(obj, Decimal):
+            return float(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def loads(self, data: bytes) -> Dict:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, default=self._default).encode()
+
+
+class OrjsonSerializer:
+    name = 'orjson'
+
+    @staticmethod
+    def _default(obj: Any) -> Any:
+        if isinstance(obj, Decimal):
+            return float(obj)
+        raise TypeError
+
+    def loads(self, data: bytes) -> Dict:
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        # UUID и datetime orjson сериализует сам
+        return orjson.dumps(obj, default=self._default)
+
+
+class MsgspecSerializer:
+    name = 'msgspec'
+
+    def __init__(self) -> None:
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def loads(self, data: bytes) -> Dict:
+        return self._decoder.decode(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj)
+
+
+def get_serializer(name: Optional[str] = None):
+    """Сериализатор по имени; 'auto' или None - самый быстрый из установленных."""
+    if name in (None, '', 'auto'):
+        if orjson is not None:
+            return OrjsonSerializer()
+        if msgspec is not None:
+            return MsgspecSerializer()
+        return JsonSerializer()
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError("orjson is not installed")
+        return OrjsonSerializer()
+    if name == 'msgspec':
+        if msgspec is None:
+            raise ValueError("msgspec is not installed")
+        return MsgspecSerializer()
+    if name == 'json':
+        return JsonSerializer()
+    raise ValueError(f"Unknown serializer: {name}")
+
+
+DEFAULT_SERIALIZER = get_serializer()
@@ -0,0 +1,95 @@
+import threading
+import time
+from logging import Logger
+from typing import Callable, List, Optional
+
+from .backpressure import AdaptiveBatchSizer
+from .kafka_connectors import KafkaMessage
+from .sources import MessageSource
+
+
+class StreamingLoop:
+    """Непрерывное чтение топика в отдельном потоке.
+
+    Сообщения копятся в буфере и передаются в handler пачкой, когда набралось
+    batch_size сообщений или прошло linger_ms с первого сообщения в буфере.
+    С sizer размер пачки подстраивается под время обработки. Пока handler
+    работает, poll не вызывается, а предвыборка librdkafka ограничена
+    max_prefetch_kbytes консьюмера, так что память остаётся ограниченной.
+    """
+
+    def __init__(self,
+                 consumer: MessageSource,
+                 handler: Callable[[List[KafkaMessage]], None],
+                 logger: Logger,
+                 batch_size: int = 100,
+                 linger_ms: int = 500,
+                 poll_timeout: float = 1.0,
+                 error_backoff: float = 5.0,
+                 sizer: Optional[AdaptiveBatchSizer] = None) -> None:
+        self._consumer = consumer
+        self._handler = handler
+        self._logger = logger
+        self._batch_size = batch_size
+        self._linger = linger_ms / 1000
+        self._poll_timeout = poll_timeout
+        self._error_backoff = error_backoff
+        self._sizer = sizer
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='streaming-consumer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def batch_size(self) -> int:
+        return self._sizer.size if self._sizer is not None else self._batch_size
+
+    def _flush(self, buffer: List[KafkaMessage]) -> None:
+        started = time.monotonic()
+        try:
+            self._handler(buffer)
+        except Exception:
+            # Обработчик сам откатывает оффсеты, пачка будет прочитана заново.
+            self._logger.exception("Batch processing failed, retrying after backoff")
+            if self._sizer is not None:
+                self._sizer.record(len(buffer), float('inf'))
+            self._stop.wait(self._error_backoff)
+            return
+        if self._sizer is not None:
+            self._sizer.record(len(buffer), time.monotonic() - started)
+
+    def _run(self) -> None:
+        buffer: List[KafkaMessage] = []
+        deadline = 0.0
+
+        while not self._stop.is_set():
+            timeout = self._poll_timeout
+            if buffer:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+
+            try:
+                messages = self._consumer.consume_batch(max(1, self.batch_size - len(buffer)), timeout)
+            except Exception:
+                self._logger.exception("Kafka poll failed")
+                self._stop.wait(self._error_backoff)
+                continue
+            if messages and not buffer:
+                deadline = time.monotonic() + self._linger
+            buffer.extend(messages)
+
+            if buffer and (len(buffer) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(buffer)
+                buffer = []
+
+        # Graceful shutdown: дописываем накопленное и отдаём партиции группе.
+        if buffer:
+            self._flush(buffer)
+        self._consumer.close()
+        self._logger.info("Streaming consumer stopped")
@@ -0,0 +1,4 @@
+from .metrics import (BATCH_SIZE, MESSAGES_CONSUMED, MESSAGES_DEAD_LETTERED, MESSAGES_FILTERED,  # noqa
+                      MESSAGES_PROCESSED, STAGE_SECONDS, mark_batch, metrics_response, register_consumer,
+                      register_pg_pool, seconds_since_last_batch, timed)
+from .readiness import ReadinessProbe  # noqa
@@ -0,0 +1,90 @@
+import time
+from typing import Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+
+# Счётчики и гистограммы обновляются в горячем пути, поэтому только Counter.inc
+# и Histogram.observe на уровне пачки, без операций на каждое сообщение.
+
+MESSAGES_CONSUMED = Counter('messages_consumed_total', 'Messages read from the source topic')
+MESSAGES_FILTERED = Counter('messages_filtered_total', 'Messages skipped without processing')
+MESSAGES_PROCESSED = Counter('messages_processed_total', 'Messages written to the warehouse')
+MESSAGES_DEAD_LETTERED = Counter('messages_dead_lettered_total', 'Messages routed to the dead letter sink', ['stage'])
+
+STAGE_SECONDS = Histogram(
+    'stage_duration_seconds',
+    'Batch processing time by stage',
+    ['stage'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+)
+
+BATCH_SIZE = Histogram(
+    'batch_size_messages',
+    'Messages per processed batch',
+    buckets=(1, 5, 10, 30, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+
+LAST_BATCH_TIMESTAMP = Gauge('last_batch_timestamp_seconds', 'Unix time of the last successfully written batch')
+LAST_BATCH_TIMESTAMP.set_to_current_time()
+_last_batch = time.monotonic()
+
+
+def timed(stage: str):
+    """Контекстный менеджер, записывающий длительность блока в stage_duration_seconds."""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def mark_batch() -> None:
+    global _last_batch
+    _last_batch = time.monotonic()
+    LAST_BATCH_TIMESTAMP.set_to_current_time()
+
+
+def seconds_since_last_batch() -> float:
+    return time.monotonic() - _last_batch
+
+
+class _ConsumerLagCollector:
+    # Отставание считается в момент запроса /metrics, из кешированных watermark librdkafka.
+    def __init__(self, consumer) -> None:
+        self._consumer = consumer
+
+    def collect(self):
+        lag = GaugeMetricFamily('kafka_consumer_lag', 'Messages behind the high watermark',
+                                labels=['topic', 'partition'])
+        total = GaugeMetricFamily('kafka_consumer_lag_sum', 'Total lag of partitions assigned to this pod')
+        values = self._consumer.lag()
+        for (topic, partition), value in values.items():
+            lag.add_metric([topic, str(partition)], value)
+        total.add_metric([], sum(values.values()))
+        yield lag
+        yield total
+
+
+class _PgPoolCollector:
+    def __init__(self, db) -> None:
+        self._db = db
+
+    def collect(self):
+        pool = GaugeMetricFamily('pg_pool_connections', 'Connection pool state', labels=['state'])
+        stats = self._db.pool_stats()
+        if stats:
+            pool.add_metric(['size'], stats.get('pool_size', 0))
+            pool.add_metric(['available'], stats.get('pool_available', 0))
+            pool.add_metric(['used'], stats.get('pool_size', 0) - stats.get('pool_available', 0))
+            pool.add_metric(['waiting'], stats.get('requests_waiting', 0))
+        yield pool
+
+
+def register_consumer(consumer) -> None:
+    REGISTRY.register(_ConsumerLagCollector(consumer))
+
+
+def register_pg_pool(db) -> None:
+    REGISTRY.register(_PgPoolCollector(db))
+
+
+def metrics_response() -> Tuple[bytes, int, dict]:
+    return generate_latest(REGISTRY), 200, {'Content-Type': CONTENT_TYPE_LATEST}